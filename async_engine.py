@@ -0,0 +1,227 @@
+import asyncio
+import json
+import time
+
+from image_cache import PartialImage
+from metrics import timed_stage
+from token_cache import AUTH_REJECTED_STATUS
+
+try:
+    import aiohttp
+except ImportError:  # 异步引擎为可选功能，未安装aiohttp时仍可使用线程池引擎
+    aiohttp = None
+
+
+class AsyncEngine:
+    """基于asyncio的下载引擎
+
+    同步、获取日记详情和下载图片都以协程执行，所有请求共用一个并发限制，
+    请求速率由 downloader.rate_limiter 控制。
+    解析、保存逻辑复用 DiaryDownloader 的方法，输出与线程池引擎一致。
+    """
+
+    def __init__(self, downloader, max_concurrency=5, request_timeout=15,
+                 chunk_size=64 * 1024):
+        if aiohttp is None:
+            raise RuntimeError("使用异步引擎需要先安装aiohttp: pip install aiohttp")
+
+        self.downloader = downloader
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.rate_limiter = downloader.rate_limiter
+        self.retry_policy = downloader.retry_policy
+        self.metrics = downloader.metrics
+        self.chunk_size = chunk_size
+
+    def post_json(self, url, data):
+        """发送单个POST请求并返回JSON（供同步接口使用）"""
+        async def run():
+            async with self._open_session() as session:
+                return await self._post_json(session, asyncio.Semaphore(1), url, data)
+
+        return asyncio.run(run())
+
+    def run_pipeline(self, batches, author_user_id, on_batch, on_image,
+                     image_cache, initial_tasks=(), queue_size=200):
+        """流水线：获取日记详情的同时下载图片
+
+        每批日记获取完成后调用 on_batch(batch, diaries)，返回的图片任务立即进入下载队列；
+        每张图片完成后调用 on_image(task, 错误或None)。
+        已获取未处理的批次和排队的图片都有上限，内存占用与日记总数无关。
+        """
+        async def run():
+            limit = asyncio.Semaphore(self.max_concurrency)
+            results = asyncio.Queue(maxsize=self.max_concurrency * 2)
+            images = asyncio.Queue(maxsize=queue_size)
+            batch_queue = asyncio.Queue()
+            for batch in batches:
+                batch_queue.put_nowait(batch)
+
+            async with self._open_session() as session:
+                async def fetch_worker():
+                    while not batch_queue.empty():
+                        batch = batch_queue.get_nowait()
+                        try:
+                            diaries = await self._fetch_batch(session, limit, batch, author_user_id)
+                        except Exception as e:
+                            self.downloader.log(f"获取日记失败: {e}", "WARN")
+                            diaries = []
+                        await results.put((batch, diaries))
+
+                async def image_worker():
+                    while True:
+                        task = await images.get()
+                        if task is None:
+                            return
+                        try:
+                            await self.retry_policy.call_async(
+                                self._download_image, session, limit, task, image_cache)
+                            on_image(task, None)
+                        except Exception as e:
+                            on_image(task, e)
+
+                fetchers = [asyncio.create_task(fetch_worker())
+                            for _ in range(min(self.max_concurrency, len(batches)))]
+                downloaders = [asyncio.create_task(image_worker())
+                               for _ in range(self.max_concurrency)]
+
+                try:
+                    for task in initial_tasks:
+                        await images.put(task)
+
+                    for _ in range(len(batches)):
+                        batch, diaries = await results.get()
+                        for task in on_batch(batch, diaries):
+                            await images.put(task)
+
+                    for _ in downloaders:
+                        await images.put(None)
+                    await asyncio.gather(*fetchers, *downloaders)
+                finally:
+                    for worker in fetchers + downloaders:
+                        worker.cancel()
+
+        asyncio.run(run())
+
+    def _open_session(self):
+        return aiohttp.ClientSession(
+            headers=dict(self.downloader.session.headers),
+            # 与线程池引擎中 requests 的 timeout 相同：限制连接和每次读取的等待时间，
+            # 不限制总时长，慢速网络下的大图片不会因为总时长超时而失败
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.request_timeout,
+                                          sock_read=self.request_timeout),
+            connector=aiohttp.TCPConnector(ssl=False, limit=self.max_concurrency)
+        )
+
+    async def _post_json(self, session, limit, url, data, retry_auth=True):
+        token = self.downloader.token
+        # 限速等待在占用并发名额之前，不阻塞其他请求
+        await self.rate_limiter.acquire_async(url)
+        async with limit:
+            start = time.perf_counter()
+            try:
+                # 重新登录后session中的认证头已过期，每次请求使用当前的token
+                headers = {"auth": f"token {token}"} if token else None
+                async with session.post(url, data=data, headers=headers) as response:
+                    body = await response.read()
+            except asyncio.TimeoutError:
+                self.metrics.record_request(url, "timeout", time.perf_counter() - start)
+                self.rate_limiter.feedback(url, timeout=True)
+                raise
+            except aiohttp.ClientError:
+                self.metrics.record_request(url, "error", time.perf_counter() - start)
+                raise
+        self.metrics.record_request(url, response.status, time.perf_counter() - start, len(body))
+        self._feedback(url, response)
+        # 接口拒绝token时重新登录（在线程中进行，不阻塞事件循环）后重试一次
+        if (response.status in AUTH_REJECTED_STATUS and retry_auth and token
+                and await asyncio.to_thread(self.downloader.refresh_token, token)):
+            return await self._post_json(session, limit, url, data, retry_auth=False)
+        response.raise_for_status()
+        return json.loads(body)
+
+    def _feedback(self, url, response):
+        self.rate_limiter.feedback(
+            url, response.status, response.headers.get("Retry-After"))
+
+    @timed_stage("fetch")
+    async def _get_diaries_by_ids(self, session, limit, diary_ids, author_user_id):
+        url = f"{self.downloader.api_base}/api/diary/all_by_ids/{author_user_id}/"
+        data = {"diary_ids": ",".join(str(diary_id) for diary_id in diary_ids)}
+        result = await self._post_json(session, limit, url, data)
+
+        if result.get("error") != 0:
+            raise ValueError(f"接口返回错误: {result}")
+
+        return [self.downloader.parse_diary(diary, author_user_id)
+                for diary in result.get("diaries") or []]
+
+    async def _fetch_batch(self, session, limit, diary_ids, author_user_id):
+        """与 DiaryDownloader.fetch_diaries_batch 相同：失败或缺失时二分拆分重试"""
+        log = self.downloader.log
+        try:
+            diaries = await self.retry_policy.call_async(
+                self._get_diaries_by_ids, session, limit, diary_ids, author_user_id)
+        except Exception as e:
+            if len(diary_ids) == 1:
+                log(f"获取日记 {diary_ids[0]} 详情失败: {e}", "ERROR")
+                return []
+            log(f"批量获取 {len(diary_ids)} 篇日记失败，拆分重试: {e}", "WARN")
+            diaries = []
+            missing = list(diary_ids)
+        else:
+            returned_ids = {str(diary.get("id")) for diary in diaries}
+            missing = [diary_id for diary_id in diary_ids
+                       if str(diary_id) not in returned_ids]
+            if missing and len(diary_ids) == 1:
+                log(f"获取日记 {diary_ids[0]} 失败: 未返回内容", "WARN")
+                return diaries
+
+        if missing:
+            mid = (len(missing) + 1) // 2
+            parts = [part for part in (missing[:mid], missing[mid:]) if part]
+            for fetched in await asyncio.gather(
+                    *(self._fetch_batch(session, limit, part, author_user_id) for part in parts)):
+                diaries.extend(fetched)
+
+        return diaries
+
+    @timed_stage("images")
+    async def _download_image(self, session, limit, task, image_cache):
+        """下载单张图片，失败时抛出异常"""
+        image_id = task["image_id"]
+        url = f"{self.downloader.image_base}/api/image/{task['user_id']}/{image_id}/"
+        partial = None
+        start = response = None
+
+        try:
+            await self.rate_limiter.acquire_async(url)
+            async with limit:
+                start = time.perf_counter()
+                async with session.get(url) as response:
+                    # 图片的请求耗时记到收到响应头为止，字节数在读取时累计
+                    self.metrics.record_request(url, response.status, time.perf_counter() - start)
+                    self._feedback(url, response)
+                    response.raise_for_status()
+                    partial = PartialImage(task["folder"], image_id, response.headers)
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        partial.write(chunk)
+                        self.metrics.add_bytes(url, len(chunk))
+
+            image_path = partial.commit()
+            if image_cache is not None:
+                image_cache.record(image_id, image_path, partial.sha256)
+
+        except asyncio.TimeoutError:
+            # 已收到响应头的请求已经记录过
+            if start is not None and response is None:
+                self.metrics.record_request(url, "timeout", time.perf_counter() - start)
+            self.rate_limiter.feedback(url, timeout=True)
+            raise
+        except aiohttp.ClientError:
+            if start is not None and response is None:
+                self.metrics.record_request(url, "error", time.perf_counter() - start)
+            raise
+        finally:
+            if partial is not None:
+                partial.discard()
@@ -0,0 +1,384 @@
+"""性能测试：在本地模拟服务器上比较线程池引擎和异步引擎
+
+用法: python benchmark.py --diaries 300 --latency 0.05
+模拟服务器错误和限流: python benchmark.py --error-rate 0.05 --server-rate 50
+输出登录、同步、下载、生成HTML各阶段的耗时、请求数、日记/秒、图片/秒和MB/秒
+比较HTML生成的串行渲染和多进程渲染（输出不一致时退出码为1）: python benchmark.py --render --diaries 3000
+检查各Markdown渲染器输出是否一致并比较速度（不一致时退出码为1）: python benchmark.py --renderers --diaries 1500
+隐私内容解密的微基准（结果与原实现不一致时退出码为1）: python benchmark.py --privacy --diaries 2000
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import os
+import re
+from html.parser import HTMLParser
+import tempfile
+import shutil
+import sys
+import time
+
+from Crypto.Cipher import AES
+
+import main as exporter
+import privacy
+import trans
+from renderers import available_renderers, get_renderer
+from mock_server import MockData, MockServer
+from rate_limiter import RateLimiter
+
+
+def tree_digest(folder, exclude=()):
+    """计算目录下所有文件（路径+内容）的哈希，用于比较不同引擎的输出是否一致"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name in exclude:
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, folder).replace(os.sep, "/").encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def run_export(engine, server, workdir, rate_limit, build=True):
+    """在独立的工作目录中完整导出一次（登录、同步、下载、生成HTML）
+
+    返回 (各阶段统计, 输出哈希, 客户端统计)，各阶段统计为 [(阶段, 耗时, 请求数, 字节数)]，
+    客户端统计为导出器记录的 RunMetrics
+    """
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    phases = []
+
+    @contextlib.contextmanager
+    def phase(name):
+        requests_before, bytes_before = server.requests, server.bytes_sent
+        start = time.perf_counter()
+        yield
+        phases.append((name, time.perf_counter() - start,
+                       server.requests - requests_before, server.bytes_sent - bytes_before))
+
+    try:
+        downloader = exporter.DiaryDownloader("mock@example.com", "mock", engine)
+        downloader.api_base = server.base_url
+        downloader.image_base = server.base_url
+        downloader.rate_limiter = RateLimiter({"127.0.0.1": rate_limit})
+
+        # 屏蔽导出过程中的日志和进度条
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            with phase("login"):
+                downloader.login()
+            with phase("sync"):
+                sync_data = downloader.get_sync_data()
+            with phase("download"):
+                downloader.download_diaries(sync_data)
+            if build:
+                # 模拟服务器的图片不是真正的图片，不生成缩略图
+                with phase("html"):
+                    trans.build_html(os.path.join(workdir, "myself"), sources=downloader.saved_markdown,
+                                     thumbnail_width=0)
+
+        return phases, tree_digest(os.path.join(workdir, "myself", "markdown")), downloader.metrics
+    finally:
+        os.chdir(cwd)
+
+
+def print_phases(phases, diaries, images):
+    """输出各阶段的耗时和吞吐量"""
+    print(f"  {'阶段':<10}{'耗时(s)':>10}{'请求数':>8}{'MB':>8}{'日记/秒':>10}{'图片/秒':>10}{'MB/秒':>8}")
+    total = ("total", sum(p[1] for p in phases), sum(p[2] for p in phases), sum(p[3] for p in phases))
+    for name, elapsed, requests, size in phases + [total]:
+        mb = size / 1024 / 1024
+        elapsed = max(elapsed, 1e-9)
+        # 日记/秒和图片/秒只对处理日记和图片的阶段有意义
+        diary_rate = f"{diaries / elapsed:.1f}" if name in ("download", "html", "total") else "-"
+        image_rate = f"{images / elapsed:.1f}" if name in ("download", "total") else "-"
+        print(f"  {name:<10}{elapsed:>10.2f}{requests:>8}{mb:>8.2f}{diary_rate:>10}{image_rate:>10}{mb / elapsed:>8.2f}")
+
+
+def print_latency(metrics):
+    """输出导出器记录的各主机（及各阶段中各主机）的请求延迟分位数、状态码和重试次数"""
+    data = metrics.to_dict()
+    rows = [(host, entry) for host, entry in data["hosts"].items()]
+    rows += [(f"{phase} {host}", entry) for phase, table in data["phase_hosts"].items()
+             for host, entry in table.items()]
+    for name, entry in rows:
+        latency = " ".join(f"{key} {value * 1000:.1f}ms" for key, value in entry["latency"].items())
+        print(f"  {name}: {entry['requests']} 次请求，{latency}，状态码 {entry['status']}")
+    if data["retries"]["total"]:
+        print(f"  重试 {data['retries']['total']} 次: {data['retries']['reasons']}")
+
+
+def run_render_benchmark(diaries, workers):
+    """用合成日记比较串行渲染和多进程渲染生成HTML的耗时，返回两者输出是否一致"""
+    data = MockData(diaries, images_per_diary=0)
+    with tempfile.TemporaryDirectory() as workdir:
+        base_folder = os.path.join(workdir, "myself")
+        write_markdown(data.diaries.values(), base_folder)
+
+        print(f"[INFO] {diaries} 篇日记，多进程渲染使用 {workers or os.cpu_count()} 个进程")
+        print(f"{'方式':<8}{'总耗时(s)':>10}{'渲染(s)':>10}{'日记/秒':>10}  输出哈希")
+        digests = set()
+        for name, render_workers in [("serial", 1), ("parallel", workers)]:
+            # 删除输出目录（含渲染缓存），每次都完整生成
+            shutil.rmtree(os.path.join(base_folder, "html"), ignore_errors=True)
+            result = trans.build_html(base_folder, render_workers=render_workers)
+            digest = tree_digest(os.path.join(base_folder, "html"), exclude={trans.BUILD_CACHE_FILE})
+            digests.add(digest)
+            print(f"{name:<8}{result['elapsed']:>10.2f}{result['render_time']:>10.2f}"
+                  f"{diaries / result['render_time']:>10.1f}  {digest[:12]}")
+
+    if len(digests) > 1:
+        print("[ERROR] 串行和多进程渲染的输出不一致")
+        return False
+    print("[INFO] 串行和多进程渲染输出一致")
+    return True
+
+
+# 渲染器一致性检查用的日记，覆盖导出的Markdown中会出现的写法：
+# ==日期 星期== 行、图片引用、加粗的天气/心情行、解密后的隐私内容
+PARITY_DIARIES = [
+    {"createddate": "2024-01-01", "title": "元旦", "weather": "晴", "mood": "开心",
+     "content": "    今天去爬山了。\n    风很大[图1]\n[图2]"},
+    {"createddate": "2024-01-02", "title": "", "weather": "", "mood": "",
+     "content": "公开的部分\n[隐私内容开始]\n只有自己能看的内容\n第二行\n[隐私内容结束]\n后面的内容"},
+    {"createddate": "2024-01-03", "title": "符号", "weather": "雨", "mood": "",
+     "content": "价格 5*3 = 15，a_b_c，<不是标签> & 符号\n\n\n空行之后"},
+    {"createddate": "2024-01-04", "title": "", "weather": "", "mood": "疲惫",
+     "content": "[图3]"},
+]
+
+# 日记正文中可能出现、但各渲染器规则不同的写法（只提示，不算不一致）
+KNOWN_DIFFERENCES = {
+    "行首#": "#话题 今天",
+    "紧跟段落的列表": "买菜\n1. 白菜\n- 萝卜",
+}
+
+
+class HTMLCanonicalizer(HTMLParser):
+    """把HTML转换为便于比较的标记序列：属性排序、合并空白、忽略自闭合写法的差异"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tokens = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tokens.append(("start", tag, tuple(sorted(attrs))))
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        self.tokens.append(("end", tag))
+
+    def handle_data(self, data):
+        data = re.sub(r"\s+", " ", data).strip()
+        if data:
+            self.tokens.append(("text", data))
+
+
+def canonical_html(html_text):
+    parser = HTMLCanonicalizer()
+    parser.feed(html_text)
+    parser.close()
+    return parser.tokens
+
+
+def write_markdown(diaries, base_folder):
+    """用导出程序把接口格式的日记写成Markdown，返回 [(文件路径, Markdown内容)]
+
+    与导出时一样先经过 parse_diary（去除段首缩进等），否则缩进的段落会被渲染为代码块
+    """
+    downloader = exporter.DiaryDownloader("mock@example.com", "mock")
+    for diary in diaries:
+        downloader.save_diary_markdown(downloader.parse_diary(diary, None), base_folder)
+    return list(downloader.saved_markdown.items())
+
+
+def run_renderer_benchmark(diaries):
+    """检查各Markdown渲染器与 python-markdown 的输出是否一致，并比较渲染速度
+
+    返回是否全部一致（已知差异不算）
+    """
+    renderers = available_renderers()
+    print(f"[INFO] 可用的渲染器: {', '.join(renderers)}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        samples = write_markdown(PARITY_DIARIES, os.path.join(workdir, "parity"))
+        corpus = write_markdown(MockData(diaries, images_per_diary=1).diaries.values(),
+                                os.path.join(workdir, "corpus"))
+
+    # 一致性检查：完整的Markdown（含第一行）和生成的日记片段都要一致
+    def outputs(name):
+        render = get_renderer(name)
+        return ([canonical_html(render(text)) for _, text in samples]
+                + [canonical_html(entry["fragment"]) for entry in trans.render_batch(samples, name)])
+
+    expected = outputs("python-markdown")
+    consistent = True
+    for name in renderers:
+        if name == "python-markdown":
+            continue
+        results = outputs(name)
+        mismatched = sorted({os.path.basename(samples[i % len(samples)][0])
+                             for i, (got, want) in enumerate(zip(results, expected)) if got != want})
+        if mismatched:
+            consistent = False
+            print(f"[ERROR] {name} 与 python-markdown 输出不一致: {', '.join(mismatched)}")
+        else:
+            print(f"[INFO] {name} 与 python-markdown 输出一致（{len(samples)} 篇样例）")
+        differences = [label for label, text in KNOWN_DIFFERENCES.items()
+                       if canonical_html(get_renderer(name)(text))
+                       != canonical_html(get_renderer("python-markdown")(text))]
+        if differences:
+            print(f"[INFO] {name} 的已知差异: {', '.join(differences)}")
+
+    # 速度比较（单进程）
+    size_mb = sum(len(text.encode("utf-8")) for _, text in corpus) / 1024 / 1024
+    print(f"[INFO] {len(corpus)} 篇日记，{size_mb:.1f} MB Markdown")
+    print(f"{'渲染器':<18}{'耗时(s)':>10}{'日记/秒':>10}{'MB/秒':>8}")
+    for name in renderers:
+        trans.render_batch(corpus[:10], name)  # 预热
+        start = time.perf_counter()
+        trans.render_batch(corpus, name)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<18}{elapsed:>10.2f}{len(corpus) / elapsed:>10.1f}{size_mb / elapsed:>8.2f}")
+    return consistent
+
+
+def legacy_process_content(content, user_id, comma="，"):
+    """原来的实现（逐段新建解密器、str.replace 替换、再分别提取图片ID和去除缩进），作为对照
+
+    comma 为标记中的逗号：main.py 原来使用全角逗号，plan.py 使用半角逗号
+    """
+    pattern = (rf'\[以下是隐私区域密文{comma}请不要做任何编辑{comma}否则可能导致解密失败\](.*?)'
+               rf'\[以上是隐私日记{comma}请不要编辑密文\]')
+    for cipher_text in re.findall(pattern, content, re.DOTALL):
+        cipher_text = cipher_text.strip()
+        key = str(user_id).encode('utf-8')
+        key = key + b'\0' * (16 - len(key)) if len(key) < 16 else key[:16]
+        cipher = AES.new(key, AES.MODE_ECB)
+        decrypted = cipher.decrypt(base64.b64decode(cipher_text))
+        padding_len = decrypted[-1]
+        if padding_len <= 16:
+            decrypted = decrypted[:-padding_len]
+        decrypted_text = decrypted.decode('utf-8', errors='ignore').strip()
+        content = content.replace(
+            f"[以下是隐私区域密文{comma}请不要做任何编辑{comma}否则可能导致解密失败]{cipher_text}[以上是隐私日记{comma}请不要编辑密文]",
+            f"[隐私内容开始]\n{decrypted_text}\n[隐私内容结束]")
+    image_ids = {int(i) for i in re.findall(r'\[图(\d+)\]', content)}
+    content = '\n'.join(line[4:] if line.startswith('    ') else line for line in content.split('\n'))
+    return content, image_ids
+
+
+def encrypt_block(text, user_id, comma="，"):
+    """按服务器的格式加密一段隐私内容，comma 为标记中的逗号"""
+    key = str(user_id).encode('utf-8')[:16].ljust(16, b'\0')
+    data = text.encode('utf-8')
+    pad = 16 - len(data) % 16
+    cipher_bytes = AES.new(key, AES.MODE_ECB).encrypt(data + bytes([pad]) * pad)
+    return (f"[以下是隐私区域密文{comma}请不要做任何编辑{comma}否则可能导致解密失败]"
+            + base64.b64encode(cipher_bytes).decode() + f"[以上是隐私日记{comma}请不要编辑密文]")
+
+
+def run_privacy_benchmark(diaries, blocks=20):
+    """比较原来的隐私内容处理和 privacy.process_content 的速度，并检查结果一致，返回是否一致"""
+    user_id = 10001
+    data = MockData(diaries, images_per_diary=2)
+    contents = []  # (内容, 标记中的逗号)
+    for i, diary in enumerate(data.diaries.values()):
+        # 一半日记使用全角逗号的标记，另一半使用半角逗号的标记
+        comma = "，" if i % 2 == 0 else ","
+        paragraphs = diary["content"].split("\n")
+        for j in range(blocks):
+            secret = f"    第{j}段隐私内容\n    秘密[图{900000 + i * blocks + j}]"
+            paragraphs.insert(j % len(paragraphs), encrypt_block(secret, user_id, comma))
+        contents.append(("\n".join(paragraphs), comma))
+
+    print(f"[INFO] {diaries} 篇日记，每篇 {blocks} 段隐私内容")
+    print(f"{'实现':<10}{'耗时(s)':>10}{'日记/秒':>10}{'密文段/秒':>12}")
+    results = {}
+    implementations = [
+        ("legacy", lambda content, comma: legacy_process_content(content, user_id, comma)),
+        ("privacy", lambda content, comma: privacy.process_content(content, user_id))
+    ]
+    for name, func in implementations:
+        start = time.perf_counter()
+        results[name] = [func(content, comma) for content, comma in contents]
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10}{elapsed:>10.2f}{diaries / elapsed:>10.1f}{diaries * blocks / elapsed:>12.1f}")
+
+    if results["legacy"] != results["privacy"]:
+        print("[ERROR] 两种实现的结果不一致")
+        return False
+    print("[INFO] 两种实现的结果一致")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较线程池引擎和异步引擎的导出速度")
+    parser.add_argument("--diaries", type=int, default=300)
+    parser.add_argument("--images-per-diary", type=int, default=1)
+    parser.add_argument("--image-size", type=int, default=100 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟服务器每个请求的延迟（秒）")
+    parser.add_argument("--rate", type=float, default=exporter.API_RATE_LIMIT[0], help="初始每秒请求数")
+    parser.add_argument("--max-rate", type=float, default=exporter.API_RATE_LIMIT[2], help="最大每秒请求数")
+    parser.add_argument("--engines", nargs="+", default=["thread", "async"])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务器返回500/503的比例")
+    parser.add_argument("--server-rate", type=float, default=None, help="模拟服务器每秒允许的请求数（超过时返回429）")
+    parser.add_argument("--no-html", action="store_true", help="不计入生成HTML的阶段")
+    parser.add_argument("--render", action="store_true", help="比较HTML生成的串行渲染和多进程渲染")
+    parser.add_argument("--workers", type=int, default=None, help="多进程渲染的进程数")
+    parser.add_argument("--renderers", action="store_true", help="检查各Markdown渲染器的输出是否一致并比较速度")
+    parser.add_argument("--privacy", action="store_true", help="隐私内容解密的微基准")
+    args = parser.parse_args()
+
+    if args.privacy:
+        if not run_privacy_benchmark(args.diaries):
+            sys.exit(1)
+        return
+
+    if args.renderers:
+        # 有渲染器输出不一致时以非0状态退出
+        if not run_renderer_benchmark(args.diaries):
+            sys.exit(1)
+        return
+
+    if args.render:
+        if not run_render_benchmark(args.diaries, args.workers):
+            sys.exit(1)
+        return
+
+    rate_limit = (args.rate, min(args.rate, 1.0), args.max_rate)
+    data = MockData(args.diaries, args.images_per_diary, args.image_size)
+
+    print(f"[INFO] {args.diaries} 篇日记，{len(data.images)} 张图片，"
+          f"延迟 {args.latency}s，错误率 {args.error_rate}，服务器限流 {args.server_rate or '无'}，"
+          f"初始速率 {args.rate}/s")
+
+    digests = set()
+    with MockServer(data, latency=args.latency, error_rate=args.error_rate,
+                    rate_limit=args.server_rate) as server:
+        for engine in args.engines:
+            errors_before, throttled_before = server.errors, server.throttled
+            with tempfile.TemporaryDirectory() as workdir:
+                phases, digest, metrics = run_export(engine, server, workdir, rate_limit,
+                                                     build=not args.no_html)
+            digests.add(digest)
+            print(f"[{engine}] 输出哈希 {digest[:12]}，服务器错误 {server.errors - errors_before} 次，"
+                  f"限流 {server.throttled - throttled_before} 次")
+            print_phases(phases, args.diaries, len(data.images))
+            print_latency(metrics)
+
+    if len(digests) > 1:
+        print("[WARN] 不同引擎的输出不一致")
+    else:
+        print("[INFO] 各引擎输出一致")
+
+
+if __name__ == "__main__":
+    main()
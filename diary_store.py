@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+
+from privacy import strip_indent
+
+STORE_FILE = "diaries.db"  # 本地日记库文件名（保存在myself/partner目录下）
+
+# 日记正文的格式版本（保存在SQLite的user_version中）：
+# 1 表示正文已在获取时去除段首缩进，旧版本的日记库打开时自动迁移
+CONTENT_VERSION = 1
+
+COLUMNS = ["id", "user_id", "createddate", "ts", "title", "content",
+           "weather", "mood", "space", "createdtime", "image_ids"]
+
+
+class DiaryStore:
+    """本地日记库（SQLite），按日记ID保存完整内容和服务器时间戳"""
+
+    def __init__(self, base_folder, filename=STORE_FILE):
+        os.makedirs(base_folder, exist_ok=True)
+        self.path = os.path.join(base_folder, filename)
+        self.lock = threading.Lock()
+        # 下载时多个线程共用同一连接，由 self.lock 串行化
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS diaries (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    createddate TEXT,
+                    ts TEXT,
+                    title TEXT,
+                    content TEXT,
+                    weather TEXT,
+                    mood TEXT,
+                    space TEXT,
+                    createdtime TEXT,
+                    image_ids TEXT
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_diaries_date ON diaries (createddate)")
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < CONTENT_VERSION:
+                rows = self.conn.execute("SELECT id, content FROM diaries").fetchall()
+                self.conn.executemany(
+                    "UPDATE diaries SET content = ? WHERE id = ?",
+                    [(strip_indent(row["content"]), row["id"]) for row in rows])
+                self.conn.execute(f"PRAGMA user_version = {CONTENT_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_ts_map(self):
+        """返回 {日记ID: 服务器时间戳}（均为字符串）"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, ts FROM diaries").fetchall()
+        return {str(row["id"]): row["ts"] for row in rows if row["ts"] is not None}
+
+    def get_many(self, diary_ids):
+        """按ID读取日记，返回与 get_diaries_by_ids 相同结构的字典列表"""
+        diaries = []
+        ids = [int(diary_id) for diary_id in diary_ids]
+        with self.lock:
+            # 分段查询，避免超过SQLite的参数数量上限
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT * FROM diaries WHERE id IN ({placeholders})", part).fetchall()
+                diaries.extend(self._row_to_diary(row) for row in rows)
+        return diaries
+
+    def all(self):
+        """按日期读取全部日记"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM diaries ORDER BY createddate, id").fetchall()
+        return [self._row_to_diary(row) for row in rows]
+
+    def upsert_many(self, diaries):
+        """在一个事务中插入或更新多篇日记"""
+        rows = [self._diary_to_row(diary) for diary in diaries if diary.get("id")]
+        if not rows:
+            return 0
+
+        placeholders = ",".join("?" * len(COLUMNS))
+        updates = ",".join(f"{col}=excluded.{col}" for col in COLUMNS[1:])
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO diaries ({','.join(COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                rows)
+        return len(rows)
+
+    @staticmethod
+    def _diary_to_row(diary):
+        ts = diary.get("ts")
+        return (
+            int(diary["id"]),
+            diary.get("user_id"),
+            diary.get("createddate"),
+            None if ts is None else str(ts),
+            diary.get("title", ""),
+            diary.get("content", ""),
+            diary.get("weather", ""),
+            diary.get("mood", ""),
+            diary.get("space", ""),
+            None if diary.get("createdtime") is None else str(diary.get("createdtime")),
+            json.dumps(sorted(diary.get("image_ids") or [])),
+        )
+
+    @staticmethod
+    def _row_to_diary(row):
+        diary = {col: row[col] for col in COLUMNS}
+        diary["image_ids"] = set(json.loads(row["image_ids"] or "[]"))
+        return diary
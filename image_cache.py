@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，不支持 reflink
+    fcntl = None
+
+MANIFEST_FILE = "images_manifest.json"  # 图片清单文件名（保存在myself/partner目录下）
+IMAGE_EXTS = (".jpg", ".png")
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+PNG_TRAILER = b'IEND\xaeB`\x82'
+
+LINK_MODES = ("hardlink", "reflink", "symlink", "copy")
+FICLONE = 0x40049409  # Linux ioctl，在 btrfs/xfs 等文件系统上创建共享数据块的副本
+
+
+def file_sha256(path):
+    """计算文件的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError("当前系统不支持 reflink")
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+
+def link_image(src, dst, mode="hardlink"):
+    """把图片放到 dst：优先使用 mode 指定的链接方式，不支持时（跨磁盘、文件系统或权限不足）退回复制
+
+    返回实际使用的方式
+    """
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+            return mode
+        if mode == "reflink":
+            reflink(src, dst)
+            return mode
+        if mode == "symlink":
+            # 使用相对路径，整个 myself/partner 目录移动后链接仍然有效
+            os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+            return mode
+    except (OSError, NotImplementedError):
+        pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def is_complete_image(path):
+    """根据文件头尾判断图片是否完整（用于没有清单记录的旧文件）"""
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return False
+        with open(path, 'rb') as f:
+            head = f.read(8)
+            f.seek(max(0, size - 32))
+            tail = f.read()
+    except OSError:
+        return False
+
+    if head.startswith(JPEG_MAGIC):
+        # JPEG以FFD9结束，部分设备会在结尾补几个字节
+        return b'\xff\xd9' in tail
+    if head.startswith(PNG_MAGIC):
+        return tail.endswith(PNG_TRAILER)
+    return True
+
+
+def detect_image_ext(content_type, head):
+    """根据Content-Type或文件头确定图片扩展名"""
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        return '.jpg'
+    if 'png' in content_type:
+        return '.png'
+    # 尝试从内容判断
+    if head[:3] == JPEG_MAGIC:
+        return '.jpg'
+    if head[:8] == PNG_MAGIC:
+        return '.png'
+    return '.jpg'  # 默认
+
+
+class PartialImage:
+    """下载中的图片：分块写入临时文件，长度校验通过后原子重命名为正式文件"""
+
+    def __init__(self, target_folder, image_id, headers):
+        self.target_folder = target_folder
+        self.image_id = image_id
+        self.content_type = (headers.get('content-type') or '').lower()
+        # 经过压缩传输时Content-Length是压缩后的长度，无法用于校验
+        self.expected_length = None
+        if not headers.get('content-encoding') and headers.get('content-length'):
+            self.expected_length = int(headers.get('content-length'))
+        self.tmp_path = os.path.join(target_folder, f".{image_id}.part")
+        self.ext = None
+        self.written = 0
+        self._digest = hashlib.sha256()
+        self._file = None
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        if self._file is None:
+            # 根据第一个数据块确定文件扩展名
+            self.ext = detect_image_ext(self.content_type, chunk)
+            self._file = open(self.tmp_path, 'wb')
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.written += len(chunk)
+
+    def commit(self):
+        """校验长度并重命名为正式文件，返回文件路径"""
+        self._close()
+        if self.written == 0:
+            raise IOError("图片内容为空")
+        if self.expected_length is not None and self.written != self.expected_length:
+            raise IOError(f"图片不完整: {self.written}/{self.expected_length} 字节")
+
+        image_path = os.path.join(self.target_folder, f"{self.image_id}{self.ext}")
+        os.replace(self.tmp_path, image_path)
+        return image_path
+
+    def discard(self):
+        """删除未完成的临时文件（commit之后调用无影响）"""
+        self._close()
+        if os.path.exists(self.tmp_path):
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ImageCache:
+    """已下载图片的清单，记录图片ID、大小、sha256和扩展名，下载前先检查本地文件
+
+    同一张图片可能被不同月份的日记引用，每个月份的Pictures目录中各有一份，
+    因此按 "图片所在目录/图片ID" 记录
+    """
+
+    def __init__(self, base_folder, verify_hash=False):
+        self.base_folder = base_folder
+        self.path = os.path.join(base_folder, MANIFEST_FILE)
+        self.verify_hash = verify_hash
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception:
+                # 清单损坏时重新建立，已有文件会按文件头尾重新校验
+                self.entries = {}
+
+        # 旧版清单只按图片ID记录，转换为 目录/图片ID
+        for key in [key for key in self.entries if "/" not in key]:
+            entry = self.entries.pop(key)
+            if entry.get("path"):
+                self.entries[f"{entry['path'].rsplit('/', 1)[0]}/{key}"] = entry
+            self.dirty = True
+
+    def _key(self, image_id, target_folder):
+        return f"{self._relpath(target_folder)}/{image_id}"
+
+    def lookup(self, image_id, target_folder):
+        """图片在 target_folder 中已完整存在时返回文件路径，否则返回None（需要下载）"""
+        key = self._key(image_id, target_folder)
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry:
+            path = os.path.join(target_folder, f"{image_id}{entry['ext']}")
+            if self._matches(path, entry):
+                return path
+            # 文件缺失或损坏，删除记录后重新下载
+            with self.lock:
+                self.entries.pop(key, None)
+                self.dirty = True
+            return None
+
+        # 没有清单记录：检查以前下载的文件
+        for ext in IMAGE_EXTS:
+            path = os.path.join(target_folder, f"{image_id}{ext}")
+            if os.path.exists(path) and is_complete_image(path):
+                self.record(image_id, path)
+                return path
+
+        return None
+
+    def record(self, image_id, path, sha256=None):
+        """记录一张已完整下载的图片"""
+        entry = {
+            "size": os.path.getsize(path),
+            "sha256": sha256 or file_sha256(path),
+            "ext": os.path.splitext(path)[1],
+            "path": self._relpath(path)
+        }
+        with self.lock:
+            self.entries[self._key(image_id, os.path.dirname(path))] = entry
+            self.dirty = True
+
+    def save(self):
+        """有变化时写回清单"""
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.base_folder, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def _matches(self, path, entry):
+        try:
+            if os.path.getsize(path) != entry.get("size"):
+                return False
+        except OSError:
+            return False
+        if self.verify_hash:
+            return file_sha256(path) == entry.get("sha256")
+        return True
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.base_folder).replace(os.sep, "/")
@@ -0,0 +1,293 @@
+"""运行统计：各阶段耗时、各主机的请求数、字节数和延迟分位数（main.py 和 plan.py 共用）
+
+结果写入 export_stats.json 的 "metrics" 项，plan.py 还可以写入OpenMetrics文本文件；
+--profile 时用 cProfile 分析整个运行过程
+"""
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+PERCENTILES = (50, 90, 99)
+METRIC_PREFIX = "nideriji"
+NO_PHASE = "other"  # 不在任何阶段中的请求
+
+# 当前线程/协程所在的阶段；工作线程中没有设置时使用最外层正在进行的阶段
+_current_phase = contextvars.ContextVar("current_phase", default=None)
+
+
+def percentile(sorted_values, p):
+    """最近秩法计算分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, -(-len(sorted_values) * p // 100) - 1))
+    return sorted_values[int(index)]
+
+
+def summarize_host(entry):
+    """一个主机的请求统计：请求数、字节数、各状态码次数和延迟分位数"""
+    latencies = sorted(entry["latencies"])
+    latency = {f"p{p}": round(percentile(latencies, p), 4) for p in PERCENTILES}
+    latency["max"] = round(latencies[-1], 4) if latencies else 0.0
+    return {
+        "requests": entry["requests"],
+        "bytes": entry["bytes"],
+        "status": dict(sorted(entry["status"].items())),
+        "latency": latency
+    }
+
+
+class RunMetrics:
+    """一次运行的统计数据（线程安全）
+
+    阶段(phase)：登录、同步、下载、生成html等依次进行的步骤，记录墙钟时间；
+    环节(stage)：获取详情、保存Markdown、下载图片等在下载阶段中并发进行的工作，
+    记录次数和累计耗时（多个线程的耗时相加，可能超过所在阶段的墙钟时间）；
+    请求按主机统计，同时按 阶段×主机 统计（下载阶段中接口主机为获取详情，图片主机为下载图片）
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.phases = {}  # 阶段 -> {"elapsed", "count"}
+        self.running = {}  # 正在进行的阶段 -> 开始时间
+        self.stages = {}  # 环节 -> {"busy_time", "count"}
+        self.hosts = {}  # 主机 -> {"requests", "bytes", "status", "latencies"}
+        self.phase_hosts = {}  # 阶段 -> 主机 -> 同上
+        self.retries = {}  # 重试原因 -> 次数
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        with self.lock:
+            self.running[name] = start
+        token = _current_phase.set(name)
+        try:
+            yield
+        finally:
+            _current_phase.reset(token)
+            self._add(self.phases, name, "elapsed", time.perf_counter() - start)
+            with self.lock:
+                self.running.pop(name, None)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self.stages, name, "busy_time", time.perf_counter() - start)
+
+    def _add(self, table, name, key, elapsed):
+        with self.lock:
+            entry = table.setdefault(name, {key: 0.0, "count": 0})
+            entry[key] += elapsed
+            entry["count"] += 1
+
+    def _hosts(self, url):
+        """返回该请求的 (主机的统计, 当前阶段×主机的统计)，需持有 self.lock"""
+        host = urlparse(url).netloc or url
+        phase = _current_phase.get() or next(iter(self.running), NO_PHASE)
+        return [table.setdefault(host, {"requests": 0, "bytes": 0, "status": {}, "latencies": []})
+                for table in (self.hosts, self.phase_hosts.setdefault(phase, {}))]
+
+    def record_request(self, url, status, elapsed, size=0):
+        """记录一次请求；status 为HTTP状态码，或 "timeout"/"error"（未收到响应）"""
+        with self.lock:
+            for entry in self._hosts(url):
+                entry["requests"] += 1
+                entry["bytes"] += size
+                entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+                entry["latencies"].append(elapsed)
+
+    def add_bytes(self, url, size):
+        """流式下载时按块累计接收的字节数"""
+        with self.lock:
+            for entry in self._hosts(url):
+                entry["bytes"] += size
+
+    def count_retry(self, error):
+        """RetryPolicy 每次重试前调用，按HTTP状态码或异常类型分类计数"""
+        status = getattr(error, "status", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        reason = str(status) if status is not None else type(error).__name__
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def to_dict(self):
+        """转换为可写入JSON的字典；尚未结束的阶段按当前已用时间计算"""
+        now = time.perf_counter()
+        with self.lock:
+            phases = {name: {"elapsed": round(entry["elapsed"], 3), "count": entry["count"]}
+                      for name, entry in self.phases.items()}
+            for name, start in self.running.items():
+                entry = phases.setdefault(name, {"elapsed": 0.0, "count": 0})
+                entry["elapsed"] = round(entry["elapsed"] + now - start, 3)
+                entry["count"] += 1
+            stages = {name: {"busy_time": round(entry["busy_time"], 3), "count": entry["count"]}
+                      for name, entry in self.stages.items()}
+            hosts = {host: summarize_host(entry) for host, entry in self.hosts.items()}
+            phase_hosts = {phase: {host: summarize_host(entry) for host, entry in table.items()}
+                           for phase, table in self.phase_hosts.items()}
+            retries = dict(sorted(self.retries.items()))
+
+        return {
+            "elapsed": round(now - self.started, 3),
+            "phases": phases,
+            "stages": stages,
+            "hosts": hosts,
+            "phase_hosts": phase_hosts,
+            "retries": {"total": sum(retries.values()), "reasons": retries}
+        }
+
+    def summary(self):
+        """一行文字的各阶段耗时汇总，用于日志"""
+        data = self.to_dict()
+        parts = [f"{name} {entry['elapsed']:.2f}s" for name, entry in data["phases"].items()]
+        parts += [f"{host} {entry['requests']}次请求 p90 {entry['latency']['p90'] * 1000:.0f}ms"
+                  for host, entry in data["hosts"].items()]
+        return "各阶段耗时: " + ", ".join(parts)
+
+
+def timed_phase(name):
+    """方法装饰器：把方法的运行时间记为 self.metrics 中的一个阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_stage(name):
+    """方法装饰器：把方法的运行时间累计到 self.metrics 中的一个环节（也可用于协程方法）"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                with self.metrics.stage(name):
+                    return await func(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.stage(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_call(func, path, limit=25):
+    """在cProfile下运行 func，结果保存到 path（可用 python -m pstats 或 snakeviz 查看）
+
+    返回按累计耗时排序的前 limit 项文字报告；func 抛出异常（包括Ctrl+C）时同样保存
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(func)
+    finally:
+        profiler.dump_stats(path)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _quantile(key):
+    """"p90" -> "0.9"，"max" -> "1" """
+    return "1" if key == "max" else str(int(key[1:]) / 100)
+
+
+def read_last_success(path):
+    """读取上次写入的文本文件中最近一次成功的时间，没有时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            match = re.search(rf'^{METRIC_PREFIX}_last_success_timestamp_seconds (\S+)$', f.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return float(match.group(1)) if match else None
+
+
+def write_openmetrics(path, stats, success, now=None):
+    """把导出统计（export_stats.json 的内容）写为OpenMetrics文本文件
+
+    供 node_exporter 的 textfile collector 采集，可对长时间未成功或变慢的运行报警；
+    本次失败时保留上次成功的时间。先写临时文件再替换，采集时不会读到写了一半的文件
+    """
+    now = time.time() if now is None else now
+    last_success = now if success else read_last_success(path)
+    metrics = stats.get("metrics") or {}
+    lines = []
+
+    def family(name, help_text, samples, unit=""):
+        """samples: [(标签字典, 值)]"""
+        name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {name} gauge")
+        if unit:
+            lines.append(f"# UNIT {name} {unit}")
+        lines.append(f"# HELP {name} {help_text}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label_value(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    family("last_run_timestamp_seconds", "Time of the last run.", [({}, round(now, 3))], "seconds")
+    family("last_run_success", "Whether the last run succeeded (1) or failed (0).", [({}, int(bool(success)))])
+    if last_success is not None:
+        family("last_success_timestamp_seconds", "Time of the last successful run.",
+               [({}, round(last_success, 3))], "seconds")
+    family("run_duration_seconds", "Wall time of the last run.", [({}, metrics.get("elapsed", 0))], "seconds")
+    family("diaries_synced", "Diaries saved in the last run.", [({}, stats.get("total_diaries", 0))])
+    family("diaries_failed", "Diaries that could not be fetched in the last run.",
+           [({}, stats.get("failed_diaries", 0))])
+    family("images_downloaded", "Images downloaded in the last run.", [({}, stats.get("downloaded_images", 0))])
+    family("images_cached", "Images already present locally in the last run.", [({}, stats.get("cached_images", 0))])
+    family("images_failed", "Images that failed to download in the last run.", [({}, stats.get("failed_images", 0))])
+    family("phase_duration_seconds", "Wall time of each phase of the last run.",
+           [({"phase": name}, entry["elapsed"]) for name, entry in metrics.get("phases", {}).items()], "seconds")
+    family("stage_busy_seconds", "Summed busy time of each download stage of the last run.",
+           [({"stage": name}, entry["busy_time"]) for name, entry in metrics.get("stages", {}).items()], "seconds")
+    hosts = metrics.get("hosts", {})
+    family("http_requests", "HTTP requests of the last run by host and status.",
+           [({"host": host, "status": status}, count)
+            for host, entry in hosts.items() for status, count in entry["status"].items()])
+    family("http_received_bytes", "Bytes received in the last run by host.",
+           [({"host": host}, entry["bytes"]) for host, entry in hosts.items()], "bytes")
+    family("http_latency_seconds", "HTTP request latency quantiles of the last run by host.",
+           [({"host": host, "quantile": _quantile(key)}, value)
+            for host, entry in hosts.items() for key, value in entry["latency"].items()], "seconds")
+    phase_hosts = metrics.get("phase_hosts", {})
+    family("phase_http_requests", "HTTP requests of the last run by phase, host and status.",
+           [({"phase": phase, "host": host, "status": status}, count)
+            for phase, table in phase_hosts.items() for host, entry in table.items()
+            for status, count in entry["status"].items()])
+    family("phase_http_received_bytes", "Bytes received in the last run by phase and host.",
+           [({"phase": phase, "host": host}, entry["bytes"])
+            for phase, table in phase_hosts.items() for host, entry in table.items()], "bytes")
+    family("phase_http_latency_seconds", "HTTP request latency quantiles of the last run by phase and host.",
+           [({"phase": phase, "host": host, "quantile": _quantile(key)}, value)
+            for phase, table in phase_hosts.items() for host, entry in table.items()
+            for key, value in entry["latency"].items()], "seconds")
+    retries = metrics.get("retries", {})
+    family("retries", "Retries in the last run by reason (HTTP status or error type).",
+           [({"reason": reason}, count) for reason, count in retries.get("reasons", {}).items()])
+    lines.append("# EOF")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline="\n") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
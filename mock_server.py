@@ -0,0 +1,253 @@
+"""本地模拟的你的日记服务器，使用合成数据，用于离线测试和性能测试
+
+用法: python mock_server.py --diaries 500 --port 8000
+然后把 main.py/plan.py 中的 API_BASE 和 IMAGE_BASE 改为 http://127.0.0.1:8000
+
+可以模拟网络延迟（--latency）、服务器错误（--error-rate，日记详情和图片接口按比例返回500/503）
+和限流（--rate-limit，超过每秒请求数时返回429和Retry-After）
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+WORDS = ["今天", "天气", "不错", "出门", "散步", "看到", "一只猫", "晚饭", "吃了", "面条",
+         "工作", "有点累", "但是", "很开心", "朋友", "聊天", "读书", "写字", "下雨", "晴朗"]
+
+
+class MockData:
+    """合成的日记和图片数据（相同参数生成的数据完全一致）"""
+
+    def __init__(self, diaries=300, images_per_diary=1, image_size=200 * 1024,
+                 user_id=10001, seed=0):
+        self.user_id = user_id
+        self.image_size = image_size
+        rng = random.Random(seed)
+
+        start = datetime.date(2020, 1, 1)
+        self.diaries = {}
+        self.images = {}
+        image_id = 1
+        for i in range(diaries):
+            diary_id = 100000 + i
+            date = start + datetime.timedelta(days=i)
+            paragraphs = []
+            for _ in range(rng.randint(2, 6)):
+                paragraphs.append("    " + "".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))))
+            for _ in range(images_per_diary):
+                paragraphs.append(f"[图{image_id}]")
+                self.images[image_id] = diary_id
+                image_id += 1
+
+            self.diaries[diary_id] = {
+                "id": diary_id,
+                "user": user_id,
+                "createddate": date.isoformat(),
+                "createdtime": int(time.mktime(date.timetuple())),
+                "ts": 1600000000 + i,
+                "title": f"第{i + 1}篇",
+                "content": "\n".join(paragraphs),
+                "weather": rng.choice(["晴", "多云", "雨", ""]),
+                "mood": rng.choice(["开心", "平静", "疲惫", ""]),
+                "space": "boy",
+            }
+
+        # 所有图片共用同一段随机数据，只替换开头的ID，避免占用过多内存
+        self._image_body = bytes(rng.getrandbits(8) for _ in range(max(0, image_size - 5)))
+
+    def image_bytes(self, image_id):
+        """生成一张完整的"JPEG"（正确的文件头和结束标记）"""
+        body = self._image_body[:-8] + str(image_id).encode().rjust(8, b"0")
+        return b"\xff\xd8\xff" + body + b"\xff\xd9"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        # 先读完请求体，返回错误时连接仍可继续使用
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        if not self.server.mock.before_request(self):
+            return
+        data = self.server.mock.data
+
+        if self.path == "/api/login/":
+            return self._json({"error": 0, "token": self.server.mock.issue_token(), "userid": data.user_id})
+
+        if not self.server.mock.check_auth(self):
+            return
+
+        if self.path == "/api/v2/sync/":
+            since = float(form.get("diaries_ts") or 0)
+            diaries = [{"id": d["id"], "ts": d["ts"], "createddate": d["createddate"], "title": d["title"]}
+                       for d in data.diaries.values() if d["ts"] > since]
+            return self._json({"error": 0, "diaries": diaries, "diaries_paired": [],
+                               "user_config": {"userid": data.user_id}})
+
+        match = re.fullmatch(r"/api/diary/all_by_ids/(\d+)/", self.path)
+        if match:
+            if self.server.mock.inject_error(self):
+                return
+            ids = [int(i) for i in (form.get("diary_ids") or "").split(",") if i.strip().isdigit()]
+            diaries = [data.diaries[i] for i in ids if i in data.diaries]
+            return self._json({"error": 0, "diaries": diaries})
+
+        self._send(404, b"not found", "text/plain")
+
+    def do_GET(self):
+        if not self.server.mock.before_request(self) or self.server.mock.inject_error(self):
+            return
+        match = re.fullmatch(r"/api/image/(\d+)/(\d+)/", self.path)
+        if match and int(match.group(2)) in self.server.mock.data.images:
+            return self._send(200, self.server.mock.data.image_bytes(int(match.group(2))), "image/jpeg")
+        self._send(404, b"not found", "text/plain")
+
+    def _json(self, obj):
+        self._send(200, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock.count_bytes(len(body))
+
+
+class MockServer:
+    """在后台线程中运行的模拟服务器"""
+
+    def __init__(self, data=None, host="127.0.0.1", port=0, latency=0.0,
+                 error_rate=0.0, rate_limit=None, seed=0):
+        self.data = data or MockData()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # 每秒允许的请求数，None 表示不限流
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.throttled = 0
+        self.logins = 0
+        self.tokens = set()  # 有效的登录token，接口请求的token不在其中时返回401
+        self._rng = random.Random(seed)
+        self._tokens = float(rate_limit or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def before_request(self, handler):
+        """统计请求并模拟延迟；超过限流速率时返回429，返回 False 表示请求已处理完毕"""
+        with self._lock:
+            self.requests += 1
+            throttled = False
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(float(self.rate_limit), self._tokens + (now - self._last) * self.rate_limit)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                else:
+                    throttled = True
+                    self.throttled += 1
+        if throttled:
+            handler._send(429, b"too many requests", "text/plain", {"Retry-After": "1"})
+            return False
+        if self.latency:
+            time.sleep(self.latency)
+        return True
+
+    def issue_token(self):
+        with self._lock:
+            self.logins += 1
+            token = f"mock-token-{self.logins}"
+            self.tokens.add(token)
+        return token
+
+    def revoke_tokens(self):
+        """使已发出的token全部失效，模拟token过期"""
+        with self._lock:
+            self.tokens.clear()
+
+    def check_auth(self, handler):
+        """检查请求头中的token，无效时返回401，返回 False 表示请求已处理完毕"""
+        auth = handler.headers.get("auth") or ""
+        if auth.startswith("token ") and auth[len("token "):] in self.tokens:
+            return True
+        handler._send(401, b"unauthorized", "text/plain")
+        return False
+
+    def inject_error(self, handler):
+        """按 error_rate 随机返回500或503，返回 True 表示已返回错误"""
+        with self._lock:
+            failed = self.error_rate and self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+                status = self._rng.choice([500, 503])
+        if failed:
+            handler._send(status, b"server error", "text/plain")
+        return bool(failed)
+
+    def count_bytes(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟你的日记服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--diaries", type=int, default=300)
+    parser.add_argument("--images-per-diary", type=int, default=1)
+    parser.add_argument("--image-size", type=int, default=200 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="日记详情和图片接口返回500/503的比例")
+    parser.add_argument("--rate-limit", type=float, default=None, help="每秒允许的请求数，超过时返回429")
+    args = parser.parse_args()
+
+    data = MockData(args.diaries, args.images_per_diary, args.image_size)
+    server = MockServer(data, args.host, args.port, args.latency, args.error_rate, args.rate_limit)
+    print(f"[INFO] 模拟服务器已启动: {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,54 +2,113 @@ import urllib3
 import requests
 import os
 import re
-import base64
-from Crypto.Cipher import AES
 import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
-import subprocess
 import sys
 import shutil
 import json
 import time
+import threading
+import queue
+import atexit
+import multiprocessing
+import random
+import signal
 from typing import List, Dict, Set, Tuple
 from urllib.parse import urlparse
+from diary_store import DiaryStore, STORE_FILE
+from image_cache import ImageCache, PartialImage
+from async_engine import AsyncEngine
+from rate_limiter import RateLimiter
+from retry import RetryPolicy, FailureJournal, JOURNAL_FILE
+from trans import build_html
+from privacy import process_content
+from token_cache import TokenCache, TOKEN_CACHE_FILE, AUTH_REJECTED_STATUS
+from metrics import RunMetrics, timed_phase, timed_stage, profile_call, write_openmetrics
 
 # 配置
 EMAIL = ""
 PASSWORD = ""
+API_BASE = "https://nideriji.cn"
+IMAGE_BASE = "https://f.nideriji.cn"
+ENGINE = "thread"  # 下载引擎: "thread" 线程池 / "async" 异步(需安装aiohttp,也可使用命令行参数 --async)
 ORDER_OLD_TO_NEW = True
 MAX_WORKERS = 5  # 控制并发,减轻服务器压力
 REQUEST_TIMEOUT = 15
-REQUEST_INTERVAL = 0.1  # 请求间隔(秒)
+# 自适应限速(每秒请求数: 初始, 最小, 最大),响应正常时逐步提速,遇到429/5xx/超时减半
+API_RATE_LIMIT = (10.0, 1.0, 30.0)  # nideriji.cn 接口
+IMAGE_RATE_LIMIT = (5.0, 0.5, 20.0)  # f.nideriji.cn 图片
+# 失败重试(指数退避+随机抖动),超时、连接错误、429和5xx才重试
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0  # 秒
+RETRY_MAX_DELAY = 30.0  # 秒
+IMAGE_CHUNK_SIZE = 64 * 1024  # 图片流式下载的块大小(字节)
+PIPELINE_QUEUE_SIZE = 200  # 流水线中排队等待下载的图片数量上限
+BATCH_SIZE = 50  # 每次请求获取的日记篇数,设为1则逐篇获取
+VERIFY_IMAGE_HASH = False  # 跳过已有图片前是否校验sha256(默认只校验文件大小)
+SYNC_STATE_FILE = "sync_state.json"  # 同步游标文件(保存在myself/partner目录下)
+TOKEN_CACHE_TTL = 7 * 24 * 3600  # 登录token缓存的有效期(秒),0表示每次运行都重新登录
+PROFILE_FILE = "profile.prof"  # 命令行参数 --profile 时cProfile结果的保存位置(可用 python -m pstats 查看)
+FULL_RESYNC = False  # True表示忽略同步游标,重新获取全部日记(也可使用命令行参数 --full)
+# 每次运行后写入的OpenMetrics文本文件(供node_exporter的textfile collector采集),空字符串表示不写入
+# 例如 "/var/lib/node_exporter/textfile_collector/nideriji.prom"
+METRICS_TEXTFILE = ""
+# 常驻模式(命令行参数 --daemon): 保持登录和连接,每隔一段时间增量同步一次
+DAEMON_INTERVAL = 3600  # 两次同步的间隔(秒)
+DAEMON_JITTER = 0.1  # 间隔随机浮动的比例,避免多台机器同时请求
+LOG_FILE = "log.txt"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 日志文件超过该大小时轮转为 log.txt.1 等,0表示不按大小轮转
+LOG_ROTATE_DAILY = False  # True表示按日期轮转(log.txt.2024-05-01),不再按大小轮转
+LOG_BACKUP_COUNT = 5  # 保留的轮转日志个数
+LOG_JSON_LINES = False  # True表示日志文件每行写入一个JSON对象(time/level/message),方便程序解析
 
 # 禁用系统代理以避免SSL问题
 urllib3.disable_warnings()
 
 
 class Logger:
-    """日志记录器"""
+    """日志记录器
 
-    def __init__(self, log_file="log.txt"):
-        self.log_file = log_file
-        # 清空或创建日志文件
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(f"=== 日记下载日志 ===\n")
-            f.write(
-                f"### 开始时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("=" * 60 + "\n\n")
+    log() 只把日志放入队列,由后台线程按顺序批量写入文件并输出到控制台,
+    工作线程中大量输出警告时不会反复打开文件、互相等待。
+    日志文件超过 max_bytes 时轮转为 log.txt.1、log.txt.2 ...,
+    rotate_daily 为 True 时按日期轮转为 log.txt.2024-05-01,最多保留 backup_count 个;
+    json_lines 为 True 时文件中每行是一个JSON对象,方便程序解析;log_file 为 None 时只输出到控制台
+    """
 
-    def log(self, message, level="INFO"):
-        """写入日志"""
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_message = f"[{timestamp}] [{level}] {message}\n"
+    BATCH_SIZE = 1000  # 每次最多写入的日志条数
 
-        # 写入文件
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(log_message)
+    def __init__(self, log_file=LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 rotate_daily=LOG_ROTATE_DAILY, json_lines=LOG_JSON_LINES, console=True):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_daily = rotate_daily
+        self.json_lines = json_lines
+        self.console = console
+        self.file = None
+        self.file_date = None
+        self.file_size = 0
+        self.closed = False
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+        # 程序退出前写完队列中的日志
+        atexit.register(self.close)
+
+        if log_file and not json_lines:
+            now = datetime.datetime.now()
+            self.queue.put((now, None, f"=== 日记下载日志 ===\n"
+                                       f"### 开始时间: {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
+                                       + "=" * 60 + "\n\n"))
 
-        # 同时输出到控制台(可选)
-        print(log_message.strip())
+    def log(self, message, level="INFO"):
+        """写入日志(放入队列后立即返回)"""
+        if self.closed:
+            print(f"[{level}] {message}")
+            return
+        self.queue.put((datetime.datetime.now(), level, str(message)))
 
     def info(self, message):
         self.log(message, "INFO")
@@ -60,18 +119,171 @@ class Logger:
     def error(self, message):
         self.log(message, "ERROR")
 
+    def flush(self):
+        """等待队列中已有的日志全部写入"""
+        if not self.closed:
+            self.queue.join()
+
+    def close(self):
+        """写完剩余日志后停止后台线程并关闭文件"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                sys.stderr.write(f"写入日志失败: {e}\n")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if len(records) < len(batch):
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write(self, records):
+        """一批日志写入文件缓冲区后只刷新一次"""
+        text_lines = []
+        for time_, level, message in records:
+            if level is None:  # 文件开头的标题
+                line = message
+            else:
+                text = f"[{time_.strftime('%Y-%m-%d %H:%M:%S')}] [{level}] {message}"
+                text_lines.append(text.strip())
+                if self.json_lines:
+                    line = json.dumps({
+                        "time": time_.isoformat(timespec="milliseconds"),
+                        "level": level,
+                        "message": message
+                    }, ensure_ascii=False) + "\n"
+                else:
+                    line = text + "\n"
+            if self.log_file is None:
+                continue
+            size = len(line.encode("utf-8"))
+            self._open(time_.date(), size)
+            self.file.write(line)
+            self.file_size += size
+        if self.file is not None:
+            self.file.flush()
+
+        # 同时输出到控制台(可选)
+        if self.console and text_lines:
+            print("\n".join(text_lines))
+
+    def _open(self, today, size):
+        """打开日志文件,写入 size 字节前需要时先轮转"""
+        if self.file is None:
+            exists = os.path.exists(self.log_file)
+            self.file_date = datetime.date.fromtimestamp(os.path.getmtime(self.log_file)) if exists else today
+            self.file_size = os.path.getsize(self.log_file) if exists else 0
+            self.file = open(self.log_file, 'a', encoding='utf-8')
+
+        if self.rotate_daily:
+            if self.file_date != today:
+                self._rotate(f"{self.log_file}.{self.file_date.isoformat()}")
+        elif self.max_bytes and 0 < self.file_size and self.file_size + size > self.max_bytes:
+            self._rotate(None)
+        self.file_date = today
+
+    def _rotate(self, dated_name):
+        """关闭当前文件,改名为备份后重新打开(Windows下不能重命名已打开的文件)"""
+        self.file.close()
+        if dated_name:
+            os.replace(self.log_file, dated_name)
+            # 删除超出保留个数的旧日志
+            folder = os.path.dirname(os.path.abspath(self.log_file))
+            pattern = re.escape(os.path.basename(self.log_file)) + r"\.\d{4}-\d{2}-\d{2}"
+            backups = sorted(name for name in os.listdir(folder) if re.fullmatch(pattern, name))
+            for name in backups[:max(0, len(backups) - self.backup_count)]:
+                os.remove(os.path.join(folder, name))
+        elif self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.log_file}.{i}"):
+                    os.replace(f"{self.log_file}.{i}", f"{self.log_file}.{i + 1}")
+            os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+        self.file = open(self.log_file, 'a', encoding='utf-8')
+        self.file_size = 0
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    """返回全局日志器,第一次写日志时才创建(打开log.txt、启动写入线程)
+
+    多进程渲染HTML时,Windows下以spawn方式启动的子进程会重新导入本模块,
+    因此导入时不创建日志器;子进程中只输出到控制台,不写入主进程的log.txt
+    """
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            if multiprocessing.parent_process() is None:
+                _logger = Logger()
+            else:
+                _logger = Logger(log_file=None)
+        return _logger
+
 
-# 创建全局日志器
-logger = Logger()
+class LazyLogger:
+    """全局日志器的代理,调用 logger.info() 等方法时才创建日志器"""
+
+    def __getattr__(self, name):
+        return getattr(get_logger(), name)
+
+
+# 全局日志器
+logger = LazyLogger()
 
 
 class DiaryDownloader:
-    def __init__(self, email, password):
+    def __init__(self, email, password, engine=ENGINE):
         self.email = email
         self.password = password
+        self.engine = engine
+        self.api_base = API_BASE
+        self.image_base = IMAGE_BASE
+        self._async_engine = None
+        # 各阶段耗时和请求统计,写入export_stats.json
+        self.metrics = RunMetrics()
+        self.retry_policy = RetryPolicy(
+            RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, self.metrics.count_retry)
+        self.rate_limiter = RateLimiter({
+            urlparse(API_BASE).hostname: API_RATE_LIMIT,
+            urlparse(IMAGE_BASE).hostname: IMAGE_RATE_LIMIT
+        })
         self.token = None
         self.user_id = None
+        # 登录token缓存,服务器拒绝token时重新登录(多个线程只登录一次)
+        self.token_cache = TokenCache(TOKEN_CACHE_FILE, TOKEN_CACHE_TTL)
+        self.auth_lock = threading.Lock()
         self.partner_user_id = None
+        # 本次运行写入的Markdown内容,生成HTML时直接使用,不再从磁盘读取
+        self.saved_markdown = {}
+        # 本次导出的统计信息及其文件,生成HTML后再次写入以补充html阶段的耗时
+        self.stats = None
+        self.stats_file = None
+        # 本次下载的失败都已记入失败记录(或无法通过重试解决)时为True,只有这时才更新同步游标
+        self.sync_complete = False
         self.session = requests.Session()
         self.session.verify = False  # 禁用SSL验证(如果遇到证书问题)
         self.session.trust_env = False  # 禁用系统代理
@@ -79,57 +291,133 @@ class DiaryDownloader:
             "User-Agent": "OhApp/3.6.12 Platform/Android"
         })
 
-    def login(self):
-        """登录获取token"""
+    def log(self, message, level="INFO"):
+        """输出日志(供异步引擎等外部模块使用)"""
+        logger.log(message, level)
+
+    def request(self, method, url, **kwargs):
+        """发送请求,接口以401/403拒绝登录token时重新登录后重试一次"""
+        token = self.token
+        response = self._send(method, url, **kwargs)
+        if (response.status_code in AUTH_REJECTED_STATUS and token
+                and url.startswith(self.api_base) and self.refresh_token(token)):
+            response.close()
+            response = self._send(method, url, **kwargs)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        """发送一次请求:先经过限速器,再根据响应状态调整该主机的请求速率"""
+        self.rate_limiter.acquire(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.exceptions.Timeout:
+            self.metrics.record_request(url, "timeout", time.perf_counter() - start)
+            self.rate_limiter.feedback(url, timeout=True)
+            raise
+        except requests.exceptions.RequestException:
+            self.metrics.record_request(url, "error", time.perf_counter() - start)
+            raise
+        # 流式请求的字节数在读取时由调用方累计
+        self.metrics.record_request(
+            url, response.status_code, time.perf_counter() - start,
+            0 if kwargs.get("stream") else len(response.content))
+        self.rate_limiter.feedback(
+            url, response.status_code, response.headers.get("Retry-After"))
+        return response
+
+    @property
+    def async_engine(self):
+        """异步下载引擎(首次使用时创建)"""
+        if self._async_engine is None:
+            self._async_engine = AsyncEngine(
+                self,
+                max_concurrency=MAX_WORKERS,
+                request_timeout=REQUEST_TIMEOUT,
+                chunk_size=IMAGE_CHUNK_SIZE
+            )
+        return self._async_engine
+
+    @timed_phase("login")
+    def login(self, use_cache=True):
+        """登录获取token(有效期内直接使用缓存的token,不再提交邮箱和密码)"""
+        cached = self.token_cache.load(self.api_base, self.email) if use_cache else None
+        if cached:
+            self.set_token(*cached)
+            logger.info(f"使用缓存的登录信息,用户ID: {self.user_id}")
+            return True
+
         logger.info("正在登录...")
-        url = "https://nideriji.cn/api/login/"
+        url = f"{self.api_base}/api/login/"
         data = {
             "email": self.email,
             "password": self.password
         }
 
         try:
-            response = self.session.post(
-                url, data=data, timeout=REQUEST_TIMEOUT)
+            # 登录请求不经过token失效重试
+            response = self._send("POST", url, data=data)
             response.raise_for_status()
             result = response.json()
 
             if result.get("error") != 0:
                 raise ValueError(f"登录失败: {result}")
 
-            self.token = result.get("token")
-            self.user_id = result.get("userid")
-
-            if not self.token:
+            if not result.get("token"):
                 raise ValueError("登录失败,未获取到token")
 
-            # 更新session的认证头
-            self.session.headers.update({"auth": f"token {self.token}"})
+            self.set_token(result.get("token"), result.get("userid"))
+            self.token_cache.save(self.api_base, self.email, self.token, self.user_id)
 
             logger.info(f"登录成功,用户ID: {self.user_id}")
-            time.sleep(REQUEST_INTERVAL)
             return True
 
         except Exception as e:
             logger.error(f"登录失败: {e}")
             return False
 
-    def get_sync_data(self, partner=False):
-        """获取同步数据"""
+    def set_token(self, token, user_id):
+        self.token = token
+        self.user_id = user_id
+        # 更新session的认证头
+        self.session.headers.update({"auth": f"token {self.token}"})
+
+    def refresh_token(self, rejected_token):
+        """服务器拒绝了token时重新登录,返回是否已换成新的token
+
+        多个线程同时遇到时只有第一个重新登录,其他线程直接使用新的token
+        """
+        with self.auth_lock:
+            if self.token != rejected_token:
+                return bool(self.token)
+            logger.warn("登录已失效,重新登录")
+            self.token_cache.clear(self.api_base, self.email)
+            return self.login(use_cache=False)
+
+    @timed_phase("sync")
+    def get_sync_data(self, partner=False, cursors=None):
+        """获取同步数据(传入上次保存的同步游标时只返回有变化的日记)"""
         logger.info("正在获取日记列表...")
-        url = "https://nideriji.cn/api/v2/sync/"
+        url = f"{self.api_base}/api/v2/sync/"
+        cursors = cursors or {}
         data = {
             "user_config_ts": "0",
-            "diaries_ts": "0",
+            "diaries_ts": str(cursors.get("diaries_ts", "0")),
             "readmark_ts": "0",
-            "images_ts": "0"
+            "images_ts": str(cursors.get("images_ts", "0"))
         }
+        incremental = data["diaries_ts"] != "0"
+        if incremental:
+            logger.info(f"增量同步,上次同步游标: {data['diaries_ts']}")
 
         try:
-            response = self.session.post(
-                url, data=data, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            result = response.json()
+            if self.engine == "async":
+                result = self.async_engine.post_json(url, data)
+            else:
+                response = self.request("POST", url, data=data)
+                response.raise_for_status()
+                result = response.json()
 
             if result.get("error") != 0:
                 logger.error(f"同步失败: {result}")
@@ -137,6 +425,7 @@ class DiaryDownloader:
 
             if partner:
                 diaries = result.get("diaries_paired", [])
+                images = result.get("images_paired", [])
                 user_config = result.get("user_config", {}).get(
                     "paired_user_config", {})
                 user_id = user_config.get("userid")
@@ -145,6 +434,7 @@ class DiaryDownloader:
                 logger.info(f"获取到搭档 {len(diaries)} 篇日记")
             else:
                 diaries = result.get("diaries", [])
+                images = result.get("images", [])
                 user_config = result.get("user_config", {})
                 user_id = user_config.get("userid", self.user_id)
                 logger.info(f"获取到 {len(diaries)} 篇日记")
@@ -152,191 +442,171 @@ class DiaryDownloader:
             # 按日期排序
             diaries.sort(key=lambda x: x.get("createddate", ""), reverse=True)
 
-            time.sleep(REQUEST_INTERVAL)
+            # 本次同步到的最大时间戳作为下次同步的游标
+            new_cursors = {
+                "diaries_ts": self._max_ts(diaries, data["diaries_ts"]),
+                "images_ts": self._max_ts(images, data["images_ts"])
+            }
+
             return {
                 "diaries": diaries,
                 "user_id": user_id,
-                "user_config": user_config
+                "user_config": user_config,
+                "cursors": new_cursors,
+                "incremental": incremental
             }
 
         except Exception as e:
             logger.error(f"获取同步数据失败: {e}")
             return None
 
-    def get_full_diary_content(self, diary_id, author_user_id):
-        """获取单篇完整日记内容"""
-        url = f"https://nideriji.cn/api/diary/all_by_ids/{author_user_id}/"
-        data = {"diary_ids": str(diary_id)}
+    @staticmethod
+    def _max_ts(items, default="0"):
+        """取列表中最大的ts,列表为空时沿用原游标"""
+        latest = default
+        for item in items or []:
+            ts = item.get("ts") if isinstance(item, dict) else None
+            if ts is None:
+                continue
+            try:
+                if float(ts) > float(latest):
+                    latest = str(ts)
+            except (TypeError, ValueError):
+                continue
+        return latest
+
+    def load_sync_cursors(self, base_folder):
+        """读取当前账号在该目录下保存的同步游标"""
+        state_file = os.path.join(base_folder, SYNC_STATE_FILE)
+        if not os.path.exists(state_file):
+            return {}
 
         try:
-            response = self.session.post(
-                url, data=data, timeout=REQUEST_TIMEOUT)
-            time.sleep(REQUEST_INTERVAL)
-            response.raise_for_status()
-            result = response.json()
-
-            if result.get("error") != 0 or not result.get("diaries"):
-                logger.warn(f"获取日记 {diary_id} 失败: {result}")
-                return None
-
-            diary = result["diaries"][0]
-
-            # 清理内容
-            content = diary.get("content", "")
-            if content:
-                # 解密隐私内容
-                content = self.decrypt_privacy(content, author_user_id)
-                # 提取图片ID
-                image_ids = self.extract_image_ids(content)
-            else:
-                image_ids = set()
-
-            return {
-                "id": diary.get("id"),
-                "user_id": diary.get("user"),
-                "createddate": diary.get("createddate"),
-                "title": diary.get("title", ""),
-                "content": content,
-                "weather": diary.get("weather", ""),
-                "mood": diary.get("mood", ""),
-                "space": diary.get("space", ""),
-                "createdtime": diary.get("createdtime"),
-                "image_ids": image_ids
-            }
-
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
         except Exception as e:
-            logger.error(f"获取日记 {diary_id} 详情失败: {e}")
-            return None
+            logger.warn(f"读取同步游标失败,将进行完整同步: {e}")
+            return {}
 
-    def decrypt_privacy(self, content, user_id):
-        """解密隐私内容"""
-        if not content or not user_id:
-            return content
+        return state.get(str(self.user_id), {})
 
+    def save_sync_cursors(self, base_folder, cursors):
+        """保存当前账号的同步游标(按账号区分,自己/搭档分别存放在各自目录)"""
+        state_file = os.path.join(base_folder, SYNC_STATE_FILE)
+        state = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except Exception:
+                state = {}
+
+        state[str(self.user_id)] = dict(
+            cursors, sync_time=datetime.datetime.now().isoformat())
+
+        os.makedirs(base_folder, exist_ok=True)
+        tmp_file = state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, state_file)
+
+    @timed_stage("fetch")
+    def get_diaries_by_ids(self, diary_ids, author_user_id):
+        """批量获取完整日记内容(多个ID以逗号分隔,一次请求)"""
+        url = f"{self.api_base}/api/diary/all_by_ids/{author_user_id}/"
+        data = {"diary_ids": ",".join(str(diary_id) for diary_id in diary_ids)}
+
+        response = self.request("POST", url, data=data)
+        response.raise_for_status()
+        result = response.json()
+
+        if result.get("error") != 0:
+            raise ValueError(f"接口返回错误: {result}")
+
+        return [self.parse_diary(diary, author_user_id)
+                for diary in result.get("diaries") or []]
+
+    def fetch_diaries_batch(self, diary_ids, author_user_id):
+        """批量获取日记详情,整批失败或有缺失时拆分后重试"""
         try:
-            # 查找隐私区域
-            pattern = r'\[以下是隐私区域密文,请不要做任何编辑,否则可能导致解密失败\](.*?)\[以上是隐私日记,请不要编辑密文\]'
-            matches = re.findall(pattern, content, re.DOTALL)
-
-            if not matches:
-                return content
-
-            for cipher_text in matches:
-                cipher_text = cipher_text.strip()
-                if not cipher_text:
-                    continue
-
-                # 准备密钥
-                key_str = str(user_id)
-                key = key_str.encode('utf-8')
-
-                # 填充到16字节
-                if len(key) < 16:
-                    key = key + b'\0' * (16 - len(key))
-                elif len(key) > 16:
-                    key = key[:16]
-
-                # 创建AES解密器
-                cipher = AES.new(key, AES.MODE_ECB)
-
-                try:
-                    # 尝试base64解码
-                    cipher_bytes = base64.b64decode(cipher_text)
-                except:
-                    try:
-                        # 尝试hex解码
-                        cipher_bytes = bytes.fromhex(cipher_text)
-                    except:
-                        logger.warn(f"无法解码密文: {cipher_text[:50]}...")
-                        continue
-
-                # 解密
-                decrypted = cipher.decrypt(cipher_bytes)
-
-                # 移除PKCS7填充(如果存在)
-                try:
-                    padding_len = decrypted[-1]
-                    if padding_len <= 16:
-                        decrypted = decrypted[:-padding_len]
-                except:
-                    pass
-
-                # 解码为字符串
-                try:
-                    decrypted_text = decrypted.decode(
-                        'utf-8', errors='ignore').strip()
-                except:
-                    decrypted_text = "[隐私内容解密失败]"
-
-                # 替换原文中的密文
-                content = content.replace(
-                    f"[以下是隐私区域密文,请不要做任何编辑,否则可能导致解密失败]{cipher_text}[以上是隐私日记,请不要编辑密文]",
-                    f"[隐私内容开始]\n{decrypted_text}\n[隐私内容结束]"
-                )
-
-            return content
-
+            diaries = self.retry_policy.call(
+                self.get_diaries_by_ids, diary_ids, author_user_id)
         except Exception as e:
-            logger.warn(f"解密失败: {e}")
-            return content
-
-    def extract_image_ids(self, content):
-        """从内容中提取图片ID"""
-        if not content:
-            return set()
-
-        pattern = r'\[图(\d+)\]'
-        matches = re.findall(pattern, content)
-
-        # 转换为整数集合
-        image_ids = set()
-        for match in matches:
-            try:
-                image_ids.add(int(match))
-            except:
-                pass
+            if len(diary_ids) == 1:
+                logger.error(f"获取日记 {diary_ids[0]} 详情失败: {e}")
+                return []
+            logger.warn(f"批量获取 {len(diary_ids)} 篇日记失败,拆分重试: {e}")
+            diaries = []
+            missing = list(diary_ids)
+        else:
+            returned_ids = {str(diary.get("id")) for diary in diaries}
+            missing = [diary_id for diary_id in diary_ids
+                       if str(diary_id) not in returned_ids]
+            if missing and len(diary_ids) == 1:
+                logger.warn(f"获取日记 {diary_ids[0]} 失败: 未返回内容")
+                return diaries
+
+        # 二分拆分缺失部分,直到单篇获取
+        if missing:
+            mid = (len(missing) + 1) // 2
+            for part in (missing[:mid], missing[mid:]):
+                if part:
+                    diaries.extend(
+                        self.fetch_diaries_batch(part, author_user_id))
+
+        return diaries
+
+    def parse_diary(self, diary, author_user_id):
+        """整理接口返回的日记数据"""
+        # 一次扫描完成解密隐私内容、提取图片ID和去除段首缩进
+        content, image_ids = process_content(
+            diary.get("content", ""), author_user_id, self.log)
 
-        return image_ids
+        return {
+            "id": diary.get("id"),
+            "user_id": diary.get("user"),
+            "createddate": diary.get("createddate"),
+            "ts": diary.get("ts"),
+            "title": diary.get("title", ""),
+            "content": content,
+            "weather": diary.get("weather", ""),
+            "mood": diary.get("mood", ""),
+            "space": diary.get("space", ""),
+            "createdtime": diary.get("createdtime"),
+            "image_ids": image_ids
+        }
 
-    def download_image(self, image_id, user_id, target_folder):
-        """下载单张图片"""
-        url = f"https://f.nideriji.cn/api/image/{user_id}/{image_id}/"
+    @timed_stage("images")
+    def download_image(self, image_id, user_id, target_folder, image_cache=None):
+        """下载单张图片(流式写入临时文件,校验长度后再重命名),失败时抛出异常"""
+        url = f"{self.image_base}/api/image/{user_id}/{image_id}/"
+        partial = None
 
         try:
             # 下载图片
-            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
-            time.sleep(REQUEST_INTERVAL)
-            response.raise_for_status()
+            with self.request("GET", url, stream=True) as response:
+                response.raise_for_status()
 
-            # 确定文件扩展名
-            content_type = response.headers.get('content-type', '').lower()
-            if 'jpeg' in content_type or 'jpg' in content_type:
-                ext = '.jpg'
-            elif 'png' in content_type:
-                ext = '.png'
-            else:
-                # 尝试从内容判断
-                if response.content[:3] == b'\xff\xd8\xff':
-                    ext = '.jpg'
-                elif response.content[:8] == b'\x89PNG\r\n\x1a\n':
-                    ext = '.png'
-                else:
-                    ext = '.jpg'  # 默认
+                partial = PartialImage(target_folder, image_id, response.headers)
+                for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                    partial.write(chunk)
+                    self.metrics.add_bytes(url, len(chunk))
+
+            # 校验通过后原子替换为正式文件
+            image_path = partial.commit()
 
-            # 保存图片
-            image_path = os.path.join(target_folder, f"{image_id}{ext}")
-            with open(image_path, 'wb') as f:
-                f.write(response.content)
+            # 记录到图片清单,下次运行时跳过
+            if image_cache is not None:
+                image_cache.record(image_id, image_path, partial.sha256)
 
             return True
 
-        except requests.exceptions.Timeout:
-            logger.warn(f"下载图片 {image_id} 超时")
-            return False
-        except Exception as e:
-            logger.warn(f"下载图片 {image_id} 失败: {e}")
-            return False
+        finally:
+            # 清理中断或校验失败留下的临时文件
+            if partial is not None:
+                partial.discard()
 
+    @timed_stage("save")
     def save_diary_markdown(self, diary, base_folder):
         """保存日记为Markdown文件"""
         # 解析日期
@@ -369,12 +639,6 @@ class DiaryDownloader:
         weather = diary.get("weather", "")
         mood = diary.get("mood", "")
 
-        # 去除每段开头可能的的四个空格缩进 注:否则会导致html正文排版溢出
-        content_lines = content.split('\n')
-        content_lines = [line[4:] if line.startswith(
-            '    ') else line for line in content_lines]
-        content = '\n'.join(content_lines)
-
         # 替换图片引用为相对路径(指向同一文件夹内的Pictures子文件夹)
         def replace_image_ref(match):
             image_id = match.group(1)
@@ -405,8 +669,10 @@ class DiaryDownloader:
 
         # 写入文件
         file_path = os.path.join(month_folder, f"{date_str}.md")
+        markdown_text = '\n'.join(lines)
         with open(file_path, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+            f.write(markdown_text)
+        self.saved_markdown[os.path.abspath(file_path)] = markdown_text
 
         return {
             "file_path": file_path,
@@ -416,210 +682,472 @@ class DiaryDownloader:
             "image_ids": diary.get("image_ids", set())
         }
 
+    @timed_phase("download")
     def download_diaries(self, diaries_data, partner=False):
-        """下载日记"""
-        if not diaries_data or not diaries_data.get("diaries"):
+        """下载日记
+
+        以流水线方式运行:每批日记详情获取后立即保存为Markdown,
+        其中引用的图片立即加入下载队列,获取、保存和下载同时进行。
+        """
+        if not diaries_data:
             logger.error("没有日记数据")
             return False
 
-        diaries = diaries_data["diaries"]
+        self.sync_complete = False
+        diaries = diaries_data.get("diaries") or []
         author_user_id = diaries_data["user_id"]
 
-        logger.info(f"准备下载 {len(diaries)} 篇日记...")
-
         # 选择基础文件夹
         base_folder = "partner" if partner else "myself"
 
+        # 上次运行结束时仍失败的日记和图片,本次优先处理
+        journal = FailureJournal(base_folder)
+        retry_diary_ids = journal.pending_diary_ids(author_user_id)
+        retry_image_tasks = journal.pending_images(author_user_id)
+
+        if not diaries and not retry_diary_ids and not retry_image_tasks:
+            logger.error("没有日记数据")
+            return False
+
+        logger.info(f"准备下载 {len(diaries)} 篇日记...")
+        if retry_diary_ids or retry_image_tasks:
+            logger.info(f"优先重试上次失败的 {len(retry_diary_ids)} 篇日记和 {len(retry_image_tasks)} 张图片")
+
         # 创建基础文件夹
         markdown_base = os.path.join(base_folder, "markdown")
         html_base = os.path.join(base_folder, "html")
         os.makedirs(markdown_base, exist_ok=True)
         os.makedirs(html_base, exist_ok=True)
 
-        # 获取完整日记内容
-        logger.info("正在获取日记详情...")
-        full_diaries = []
-
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = []
-            for diary in diaries:
-                diary_id = diary.get("id")
-                if diary_id:
-                    future = executor.submit(
-                        self.get_full_diary_content,
-                        diary_id,
-                        author_user_id
-                    )
-                    futures.append((diary, future))
-
-            for diary, future in tqdm(futures, desc="获取日记", unit="篇"):
-                try:
-                    result = future.result(timeout=30)
-                    if result:
-                        full_diaries.append(result)
-                except Exception as e:
-                    logger.warn(f"获取日记失败: {e}")
-
-        logger.info(f"成功获取 {len(full_diaries)} 篇完整日记")
-
-        # 保存日记并按月份记录需要的图片
-        logger.info("正在保存Markdown文件...")
-        month_image_map = {}  # {year_month: {folder: path, image_ids: set()}}
-
-        for diary in tqdm(full_diaries, desc="保存日记", unit="篇"):
-            save_info = self.save_diary_markdown(diary, base_folder)
-            if save_info:
-                year_month = save_info["year_month"]
-                if year_month not in month_image_map:
-                    month_image_map[year_month] = {
-                        "folder": save_info["pictures_folder"],
-                        "image_ids": set()
-                    }
-                # 合并该月份的图片ID
-                month_image_map[year_month]["image_ids"].update(
-                    save_info["image_ids"])
-
-        # 按需下载图片(每个月份的图片都下载到对应的Pictures文件夹)
-        total_images = sum(len(info["image_ids"])
-                           for info in month_image_map.values())
-        downloaded_count = 0
+        # 本地日记库中时间戳未变化的日记直接读取,不再请求服务器
+        store = DiaryStore(base_folder)
+        stored_ts = store.get_ts_map()
+        sync_ts = {}
+        diary_ids = []
+        unchanged_ids = []
+        for diary in diaries:
+            diary_id = diary.get("id")
+            if not diary_id:
+                continue
+            ts = diary.get("ts")
+            sync_ts[str(diary_id)] = ts
+            if ts is not None and stored_ts.get(str(diary_id)) == str(ts):
+                unchanged_ids.append(diary_id)
+            else:
+                diary_ids.append(diary_id)
+
+        # 上次失败的日记排在最前面
+        diary_ids = [diary_id for diary_id in retry_diary_ids
+                     if str(diary_id) not in sync_ts] + diary_ids
+
+        if unchanged_ids:
+            logger.info(f"本地日记库中有 {len(unchanged_ids)} 篇日记未变化,跳过获取")
+
+        batch_size = max(1, BATCH_SIZE)
+        batches = [diary_ids[i:i + batch_size]
+                   for i in range(0, len(diary_ids), batch_size)]
+
+        image_cache = ImageCache(base_folder, verify_hash=VERIFY_IMAGE_HASH)
+        lock = threading.Lock()
+        fetched_ids = set()
+        queued_images = set()  # (目录, 图片ID):不同月份引用同一张图片时每个月份的目录都需要
+        months = set()
         failed_images = []
-        if total_images > 0:
-            logger.info(f"需要下载 {total_images} 张图片(按需下载)")
-
-            # 为每个月份的图片创建下载任务
-            all_download_tasks = []
-            for year_month, info in month_image_map.items():
-                pictures_folder = info["folder"]
-                for image_id in info["image_ids"]:
-                    all_download_tasks.append({
+        counts = {"saved": 0, "images": 0, "cached": 0, "downloaded": 0}
+
+        logger.info("正在获取日记详情、保存Markdown文件并下载图片...")
+        pbar_fetch = tqdm(total=len(diary_ids), desc="获取日记", unit="篇", position=0)
+        pbar_save = tqdm(total=len(diary_ids) + len(unchanged_ids),
+                         desc="保存日记", unit="篇", position=1)
+        pbar_image = tqdm(total=0, desc="下载图片", unit="张", position=2)
+
+        def queue_image(task):
+            """图片去重并检查本地缓存,需要下载时返回True"""
+            key = (os.path.normpath(task["folder"]), str(task["image_id"]))
+            if key in queued_images:
+                return False
+            queued_images.add(key)
+            counts["images"] += 1
+            # 跳过本地已完整存在的图片(根据图片清单校验大小/哈希)
+            if image_cache.lookup(task["image_id"], task["folder"]):
+                counts["cached"] += 1
+                return False
+            with lock:
+                pbar_image.total += 1
+                pbar_image.refresh()
+            return True
+
+        def save_diaries(saved_diaries):
+            """保存日记为Markdown,返回需要下载的图片任务"""
+            tasks = []
+            for diary in saved_diaries:
+                save_info = self.save_diary_markdown(diary, base_folder)
+                counts["saved"] += 1
+                pbar_save.update(1)
+                if not save_info:
+                    continue
+                months.add(save_info["year_month"])
+                for image_id in save_info["image_ids"]:
+                    task = {
                         "image_id": image_id,
                         "user_id": author_user_id,
-                        "folder": pictures_folder,
-                        "month": year_month
-                    })
-
-            # 下载图片(控制并发)
-            downloaded_count = 0
-            failed_images = []
-
-            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, 3)) as executor:
-                futures = {}
-                for task in all_download_tasks:
-                    future = executor.submit(
-                        self.download_image,
-                        task["image_id"],
-                        task["user_id"],
-                        task["folder"]
-                    )
-                    futures[future] = task
-
-                for future in tqdm(as_completed(futures), total=len(futures), desc="下载图片"):
-                    task = futures[future]
-                    try:
-                        if future.result():
-                            downloaded_count += 1
-                        else:
-                            failed_images.append(
-                                f"图片{task['image_id']} (月份: {task['month']})")
-                    except Exception as e:
-                        failed_images.append(
-                            f"图片{task['image_id']} (月份: {task['month']}) - {e}")
-
-            logger.info(f"图片下载完成: {downloaded_count}/{total_images}")
+                        "folder": save_info["pictures_folder"],
+                        "month": save_info["year_month"]
+                    }
+                    if queue_image(task):
+                        tasks.append(task)
+            return tasks
+
+        def handle_batch(batch, fetched):
+            """一批日记详情获取完成:写入日记库、保存Markdown,返回需要下载的图片任务"""
+            # 详情接口未返回ts时使用同步列表中的ts
+            for diary in fetched:
+                if diary.get("ts") is None:
+                    diary["ts"] = sync_ts.get(str(diary.get("id")))
+            store.upsert_many(fetched)
+            fetched_ids.update(str(diary.get("id")) for diary in fetched)
+            pbar_fetch.update(len(batch))
+            return save_diaries(fetched)
+
+        def handle_image(task, error):
+            with lock:
+                pbar_image.update(1)
+                if error is None:
+                    counts["downloaded"] += 1
+                    return
+                failed_images.append(dict(task, error=error))
+            if isinstance(error, (requests.exceptions.Timeout, TimeoutError)):
+                logger.warn(f"下载图片 {task['image_id']} 超时")
+            else:
+                logger.warn(f"下载图片 {task['image_id']} 失败: {error}")
+
+        # 上次失败的图片排在最前面,然后是本地日记库中未变化日记的图片
+        initial_tasks = [task for task in retry_image_tasks if queue_image(task)]
+        for i in range(0, len(unchanged_ids), 500):
+            initial_tasks.extend(save_diaries(store.get_many(unchanged_ids[i:i + 500])))
+
+        try:
+            if self.engine == "async":
+                self.async_engine.run_pipeline(
+                    batches, author_user_id, handle_batch, handle_image,
+                    image_cache, initial_tasks, PIPELINE_QUEUE_SIZE)
+            else:
+                self._run_pipeline(
+                    batches, author_user_id, handle_batch, handle_image,
+                    image_cache, initial_tasks)
+        finally:
+            pbar_fetch.close()
+            pbar_save.close()
+            pbar_image.close()
+            store.close()
+            image_cache.save()
+
+        failed_diaries = [{"id": diary_id, "error": "获取详情失败"}
+                          for diary_id in diary_ids if str(diary_id) not in fetched_ids]
+        logger.info(f"成功获取 {len(fetched_ids)} 篇日记详情,保存 {counts['saved']} 篇日记")
+
+        total_images = counts["images"]
+        if total_images > 0:
+            if counts["cached"]:
+                logger.info(f"{counts['cached']} 张图片已存在,跳过下载")
+            logger.info(f"图片下载完成: {counts['downloaded']}/{total_images - counts['cached']}")
 
             # 输出下载失败的图片
             if failed_images:
                 logger.warn(f"以下 {len(failed_images)} 张图片下载失败:")
-                for failed in failed_images:
-                    logger.warn(f"  - {failed}")
+                for task in failed_images:
+                    logger.warn(f"  - 图片{task['image_id']} (月份: {task['month']}) - {task['error']}")
         else:
             logger.info("没有需要下载的图片")
 
+        # 记录仍然失败的日记和图片,下次运行时优先重试
+        # 失败记录写入失败时不更新同步游标,下次运行从原游标重新同步,失败的日记和图片不会遗漏
+        try:
+            journaled_diaries, journaled_images = journal.save(author_user_id, failed_diaries, failed_images)
+        except OSError as e:
+            logger.warn(f"写入失败记录 {JOURNAL_FILE} 失败: {e},本次不更新同步游标")
+        else:
+            self.sync_complete = True
+            if journaled_diaries or journaled_images:
+                logger.warn(f"{journaled_diaries} 篇日记和 {journaled_images} 张图片仍然失败,"
+                            f"已记录到 {JOURNAL_FILE},下次运行时优先重试")
+            given_up = len(failed_diaries) + len(failed_images) - journaled_diaries - journaled_images
+            if given_up:
+                logger.warn(f"{given_up} 项失败无法通过重试解决(如图片不存在)或已连续失败 "
+                            f"{journal.max_attempts} 次,不再重试")
+
         # 保存统计信息
         stats = {
-            "total_diaries": len(full_diaries),
+            "total_diaries": counts["saved"],
+            "failed_diaries": len(failed_diaries),
             "total_images": total_images,
-            "downloaded_images": downloaded_count,
-            "failed_images": len(failed_images) if total_images > 0 else 0,
-            "months": list(month_image_map.keys()),
+            "downloaded_images": counts["downloaded"],
+            "cached_images": counts["cached"],
+            "failed_images": len(failed_images),
+            "months": sorted(months),
             "export_time": datetime.datetime.now().isoformat(),
             "user_id": self.user_id,
             "partner": partner
         }
 
-        stats_file = os.path.join(base_folder, "export_stats.json")
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats, f, ensure_ascii=False, indent=2)
+        self.stats = stats
+        self.stats_file = os.path.join(base_folder, "export_stats.json")
+        self.write_stats()
 
         return True
 
+    def write_stats(self):
+        """写入export_stats.json,metrics项为各阶段耗时、各主机的请求数、字节数、延迟分位数和重试次数"""
+        if self.stats_file is None:
+            return
+        self.stats["metrics"] = self.metrics.to_dict()
+        with open(self.stats_file, 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f, ensure_ascii=False, indent=2)
+
+    def _run_pipeline(self, batches, author_user_id, on_batch, on_image,
+                      image_cache, initial_tasks):
+        """线程池流水线:详情获取和图片下载使用各自的线程池,同时进行
+
+        on_batch(batch, diaries) 在主线程中调用,返回需要下载的图片任务;
+        on_image(task, error) 在下载线程中调用。
+        同时进行的详情批次和排队的图片数量都有上限,内存占用与日记总数无关。
+        """
+        image_slots = threading.BoundedSemaphore(PIPELINE_QUEUE_SIZE)
+        image_executor = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, 3))
+
+        def submit_image(task):
+            # 排队的图片达到上限时阻塞,暂停处理新的日记批次
+            image_slots.acquire()
+            future = image_executor.submit(
+                self.retry_policy.call,
+                self.download_image,
+                task["image_id"],
+                task["user_id"],
+                task["folder"],
+                image_cache
+            )
+
+            def done(f):
+                try:
+                    on_image(task, f.exception())
+                finally:
+                    image_slots.release()
+
+            future.add_done_callback(done)
+
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                batch_iter = iter(batches)
+                pending = {}
+
+                def fill():
+                    while len(pending) < MAX_WORKERS * 2:
+                        batch = next(batch_iter, None)
+                        if batch is None:
+                            return
+                        future = executor.submit(
+                            self.fetch_diaries_batch, batch, author_user_id)
+                        pending[future] = batch
+
+                fill()
+                for task in initial_tasks:
+                    submit_image(task)
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch = pending.pop(future)
+                        try:
+                            fetched = future.result()
+                        except Exception as e:
+                            logger.warn(f"获取日记失败: {e}")
+                            fetched = []
+                        for task in on_batch(batch, fetched):
+                            submit_image(task)
+                    fill()
+        finally:
+            image_executor.shutdown(wait=True)
+
+    @timed_phase("rebuild")
+    def rebuild_from_store(self, base_folder):
+        """不联网,从本地日记库重新生成全部Markdown文件"""
+        if not os.path.exists(os.path.join(base_folder, STORE_FILE)):
+            logger.error(f"本地日记库不存在: {base_folder}")
+            return False
+
+        with DiaryStore(base_folder) as store:
+            diaries = store.all()
+
+        logger.info(f"从本地日记库重建 {len(diaries)} 篇日记...")
+        os.makedirs(os.path.join(base_folder, "html"), exist_ok=True)
+        for diary in tqdm(diaries, desc="保存日记", unit="篇"):
+            self.save_diary_markdown(diary, base_folder)
+
+        return True
+
+    @timed_phase("html")
     def generate_html(self, base_folder):
-        """生成HTML文件"""
+        """生成HTML文件(在当前进程中调用trans.build_html)"""
         html_folder = os.path.join(base_folder, "html")
         if not os.path.exists(html_folder):
             logger.error(f"HTML文件夹不存在: {html_folder}")
             return False
 
         try:
-            # 调用trans.py脚本(处理 Windows 编码问题)
-            result = subprocess.run(
-                [sys.executable, "trans.py", base_folder],
-                capture_output=True,
-                text=True,
-                encoding='gbk',  # Windows 系统使用 gbk 编码
-                errors='ignore',  # 忽略编码错误
-                cwd=os.getcwd()
-            )
-
-            if result.returncode == 0:
-                logger.info("HTML文件生成成功!")
-
-                # 检查输出目录
-                output_dir = os.path.join(base_folder, "html")
-                if os.path.exists(output_dir):
-                    # 列出生成的HTML文件
-                    for file in os.listdir(output_dir):
-                        if file.endswith('.html'):
-                            logger.info(f"  - {file}")
-                return True
-            else:
-                logger.error("HTML文件生成失败")
-                if result.stderr:
-                    logger.error(f"错误: {result.stderr}")
-                return False
-
+            result = build_html(os.path.abspath(base_folder),
+                                sources=self.saved_markdown)
         except Exception as e:
-            logger.error(f"运行trans.py时出错: {e}")
+            logger.error(f"生成HTML时出错: {e}")
             return False
 
+        self.saved_markdown = {}
+        for name, error in result["thumbnail_failures"]:
+            logger.warn(f"缩略图生成失败 {name}: {error}")
+        logger.info(f"HTML文件生成成功!重新渲染 {result['rendered']}/{result['total']} 篇日记,"
+                    f"耗时 {result['elapsed']:.2f} 秒")
+        if result["changed"]:
+            for path in result["written_files"]:
+                if path.endswith(".html"):
+                    logger.info(f"  - {os.path.basename(path)}")
+        else:
+            logger.info("内容未变化,HTML文件未重写")
+        self.write_stats()
+        return True
+
+    def reset_metrics(self):
+        """常驻模式下每次同步前清空上一次的统计"""
+        self.metrics = RunMetrics()
+        self.retry_policy.on_retry = self.metrics.count_retry
+        if self._async_engine is not None:
+            self._async_engine.metrics = self.metrics
+        self.stats = None
+        self.stats_file = None
+
+    def write_metrics_textfile(self, path, success):
+        """写入OpenMetrics文本文件,与export_stats.json使用同一份统计数据"""
+        self.write_stats()
+        stats = self.stats if self.stats is not None else {"metrics": self.metrics.to_dict()}
+        try:
+            write_openmetrics(path, stats, success)
+        except OSError as e:
+            logger.warn(f"写入指标文件失败: {e}")
+
 
 def main():
     """主函数"""
 
-    today = datetime.date.today()
-    three_days_ago = today - datetime.timedelta(days=3)
+    # 强制完整同步: 配置FULL_RESYNC或命令行参数 --full
+    full_resync = FULL_RESYNC or "--full" in sys.argv[1:]
     # 输入邮箱和密码
     email = EMAIL
     password = PASSWORD
-    # 创建下载器
-    downloader = DiaryDownloader(email, password)
-    # 登录
-    if not downloader.login():
-        return
+    # 创建下载器(命令行参数 --async 使用异步引擎)
+    engine = "async" if "--async" in sys.argv[1:] else ENGINE
+    downloader = DiaryDownloader(email, password, engine)
     choice = '1'
     # 选择导出目标
     partner = (choice == "2")
+    base_folder = "partner" if partner else "myself"
+
+    # 离线模式: python plan.py --rebuild 从本地日记库重建Markdown和HTML
+    if "--rebuild" in sys.argv[1:]:
+        if downloader.rebuild_from_store(base_folder):
+            downloader.generate_html(base_folder)
+        return
+
+    # 常驻模式: python plan.py --daemon
+    if "--daemon" in sys.argv[1:]:
+        run_daemon(downloader, partner, full_resync)
+        return
+
+    success = False
+    try:
+        success = run_export(downloader, partner, full_resync)
+    finally:
+        if METRICS_TEXTFILE:
+            downloader.write_metrics_textfile(METRICS_TEXTFILE, success)
+
+
+def run_daemon(downloader, partner, full_resync):
+    """常驻运行,每隔DAEMON_INTERVAL秒(带随机浮动)增量同步一次
+
+    复用同一个下载器的登录状态和连接池,收到SIGINT/SIGTERM(Windows下为Ctrl+C/Ctrl+Break)时
+    等当前这次同步完成后退出,再次收到信号时立即中断
+    """
+    stop = threading.Event()
+
+    # 信号处理函数中不写日志(日志队列的锁可能正被主线程持有)
+    def handle_signal(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle_signal)
+
+    logger.info(f"常驻模式启动,同步间隔 {DAEMON_INTERVAL} 秒")
+    while not stop.is_set():
+        downloader.reset_metrics()
+        success = False
+        try:
+            success = run_export(downloader, partner, full_resync)
+        except Exception as e:
+            logger.error(f"同步出错: {e}")
+        finally:
+            if METRICS_TEXTFILE:
+                downloader.write_metrics_textfile(METRICS_TEXTFILE, success)
+        # 只有第一次按参数完整同步,之后都是增量同步
+        full_resync = False
+        if not success:
+            # 失败后下次重新登录
+            downloader.token = None
+
+        delay = DAEMON_INTERVAL * random.uniform(1 - DAEMON_JITTER, 1 + DAEMON_JITTER)
+        if not stop.is_set():
+            logger.info(f"下次同步: {datetime.datetime.now() + datetime.timedelta(seconds=delay):%Y-%m-%d %H:%M:%S}")
+        # 分段等待:Windows下(Python 3.14之前)长时间的 wait() 中不会处理Ctrl+C/Ctrl+Break,
+        # 每次最多等待1秒,收到信号后最多1秒就能退出
+        deadline = time.monotonic() + delay
+        while not stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            stop.wait(min(remaining, 1.0))
+    logger.info("收到退出信号,常驻模式已退出")
+
+
+def run_export(downloader, partner, full_resync):
+    """登录、增量同步、下载并生成HTML,返回是否成功
+
+    常驻模式下已登录时不再重复登录
+    """
+    base_folder = "partner" if partner else "myself"
+
+    # 登录
+    if downloader.token is None and not downloader.login():
+        return False
+
+    # 读取上次同步游标,只获取有变化的日记
+    if full_resync:
+        logger.info("强制完整同步")
+        cursors = {}
+    else:
+        cursors = downloader.load_sync_cursors(base_folder)
+        if not cursors:
+            logger.info("未找到同步记录,进行完整同步")
+
     # 获取日记列表
-    sync_data = downloader.get_sync_data(partner)
+    sync_data = downloader.get_sync_data(partner, cursors)
     if not sync_data:
         logger.error("无法获取日记列表")
-        return
+        return False
 
     diaries = sync_data["diaries"]
-    if not diaries:
-        logger.info("没有日记可导出")
-        return
+    if not diaries and not FailureJournal(base_folder).has_pending():
+        logger.info("没有新增或修改的日记")
+        downloader.save_sync_cursors(base_folder, sync_data["cursors"])
+        return True
 
     # 显示日期范围
     dates = [d.get("createddate", "") for d in diaries if d.get("createddate")]
@@ -628,64 +1156,38 @@ def main():
         max_date = max(dates)
         logger.info(f"日记日期范围: {min_date} 到 {max_date}")
 
-    # 询问日期范围
-    logger.info("\n请设置导出日期范围:")
-    logger.info(f"最早日期: {min_date}")
-
-    # 获取起始年份和月份
-    start_date = three_days_ago
-    end_date = today
-    logger.info(f"日期范围: {start_date} 到 {end_date}")
-
-    # 筛选日记
-    if start_date or end_date:
-        filtered_diaries = []
-        for diary in diaries:
-            date_str = diary.get("createddate", "")
-            if date_str:
-                try:
-                    diary_date = datetime.datetime.strptime(
-                        date_str, "%Y-%m-%d").date()
-                    if start_date and diary_date < start_date:
-                        continue
-                    if end_date and diary_date > end_date:
-                        continue
-                    filtered_diaries.append(diary)
-                except:
-                    pass
-        diaries = filtered_diaries
-
     logger.info(f"将导出 {len(diaries)} 篇日记")
 
-    if not diaries:
-        logger.info("指定日期范围内没有日记")
-        return
-
-    # 更新同步数据中的日记列表
-    sync_data["diaries"] = diaries
-
     # 下载日记
     success = downloader.download_diaries(sync_data, partner)
 
     if success:
+        # 导出成功且失败都已记录时才更新同步游标,否则下次从原游标重新同步
+        if downloader.sync_complete:
+            downloader.save_sync_cursors(base_folder, sync_data["cursors"])
         logger.info("日记导出完成!")
 
         # 询问是否生成HTML
         html_choice = 'y'
         if html_choice in ["", "y", "yes"]:
-            base_folder = "partner" if partner else "myself"
             downloader.generate_html(base_folder)
 
         logger.info("\n导出完成!")
-        base_folder = "partner" if partner else "myself"
+        logger.info(downloader.metrics.summary())
 
     else:
         logger.error("导出失败")
+    return success
 
 
 if __name__ == "__main__":
     try:
-        main()
+        # 命令行参数 --profile: 用cProfile分析整个运行过程,结果保存到PROFILE_FILE
+        if "--profile" in sys.argv[1:]:
+            logger.info(profile_call(main, PROFILE_FILE))
+            logger.info(f"性能分析结果已保存到 {PROFILE_FILE}")
+        else:
+            main()
         # logger.info("\n" + "=" * 60)
         logger.info("程序执行完毕")
         # logger.info("=" * 60)
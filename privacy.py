@@ -0,0 +1,81 @@
+"""日记内容处理：解密隐私区域、提取图片ID、去除段首缩进（main.py 和 plan.py 共用）"""
+import base64
+import functools
+import re
+
+from Crypto.Cipher import AES
+
+# 服务器返回的隐私区域标记使用全角逗号，同时兼容半角逗号
+PRIVACY_PATTERN = (r'\[以下是隐私区域密文[，,]请不要做任何编辑[，,]否则可能导致解密失败\](.*?)'
+                   r'\[以上是隐私日记[，,]请不要编辑密文\]')
+IMAGE_PATTERN = r'\[图(\d+)\]'
+
+PRIVACY_START = "[隐私内容开始]"
+PRIVACY_END = "[隐私内容结束]"
+
+# 一次扫描同时处理：隐私区域、图片引用、段首的四个空格缩进（否则会导致html正文排版溢出）
+CONTENT_RE = re.compile(
+    rf'(?P<privacy>{PRIVACY_PATTERN})|(?P<image>{IMAGE_PATTERN})|(?P<indent>^ {{4}})',
+    re.DOTALL | re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=64)
+def get_cipher(user_id):
+    """按用户ID缓存AES解密器（密钥为用户ID补零到16字节）"""
+    key = str(user_id).encode('utf-8')[:16].ljust(16, b'\0')
+    return AES.new(key, AES.MODE_ECB)
+
+
+def decrypt_block(cipher_text, user_id):
+    """解密一段隐私密文，无法解码时抛出 ValueError"""
+    try:
+        cipher_bytes = base64.b64decode(cipher_text)
+    except ValueError:
+        try:
+            cipher_bytes = bytes.fromhex(cipher_text)
+        except ValueError:
+            raise ValueError(f"无法解码密文: {cipher_text[:50]}...")
+
+    decrypted = get_cipher(str(user_id)).decrypt(cipher_bytes)
+
+    # 移除PKCS7填充（如果存在）
+    if decrypted and 1 <= decrypted[-1] <= 16:
+        decrypted = decrypted[:-decrypted[-1]]
+
+    return decrypted.decode('utf-8', errors='ignore').strip()
+
+
+def process_content(content, user_id, log=None):
+    """处理日记正文，返回 (处理后的内容, 图片ID集合)
+
+    user_id 为日记作者的ID，为空时不解密；log(message, level) 用于输出警告
+    """
+    image_ids = set()
+    if not content:
+        return content, image_ids
+
+    def replace(match):
+        if match.group("image"):
+            image_ids.add(int(match.group(4)))
+            return match.group(0)
+        if match.group("indent"):
+            return ""
+
+        cipher_text = match.group(2).strip()
+        if not user_id or not cipher_text:
+            return match.group(0)
+        try:
+            decrypted = decrypt_block(cipher_text, user_id)
+        except ValueError as e:
+            if log:
+                log(str(e), "WARN")
+            return match.group(0)
+        # 解密后的内容同样需要提取图片ID和去除缩进
+        return f"{PRIVACY_START}\n{CONTENT_RE.sub(replace, decrypted)}\n{PRIVACY_END}"
+
+    return CONTENT_RE.sub(replace, content), image_ids
+
+
+def strip_indent(content):
+    """去除每段开头的四个空格缩进"""
+    return re.sub(r'^ {4}', '', content or "", flags=re.MULTILINE)
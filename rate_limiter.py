@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+def parse_retry_after(value):
+    """解析Retry-After响应头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(retry_at.tzinfo or datetime.timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+class TokenBucket:
+    """自适应令牌桶
+
+    rate 为每秒允许的请求数。响应正常时速率加性增长（每秒约增加 increase），
+    遇到429、5xx或超时时速率乘以 decrease，并按Retry-After暂停。
+    """
+
+    def __init__(self, rate, min_rate, max_rate, burst=5, increase=2.0, decrease=0.5):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """尝试取得一个请求名额，成功返回0，否则返回建议等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            # 同一时间段内并发失败的请求只降速一次
+            if now - self.last_decrease >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.last_decrease = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+class RateLimiter:
+    """按主机区分的限速器，所有请求发出前调用 acquire，收到响应后调用 feedback"""
+
+    def __init__(self, limits, default=(5.0, 0.5, 20.0)):
+        # limits: {主机名: (初始速率, 最小速率, 最大速率)}
+        self.limits = dict(limits)
+        self.default = default
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(*self.limits.get(host, self.default))
+            return self.buckets[host]
+
+    def acquire(self, url):
+        # 每次醒来重新计算，速率变化后立即生效
+        bucket = self.bucket(url)
+        while True:
+            wait = bucket.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        bucket = self.bucket(url)
+        while True:
+            wait = bucket.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def feedback(self, url, status=None, retry_after=None, timeout=False):
+        """根据响应结果调整该主机的速率"""
+        bucket = self.bucket(url)
+        if timeout or status == 429 or (status is not None and status >= 500):
+            bucket.on_throttle(parse_retry_after(retry_after))
+        elif status is not None and status < 400:
+            bucket.on_success()
+
+    def rates(self):
+        """当前各主机的速率（每秒请求数）"""
+        with self.lock:
+            return {host: round(bucket.rate, 2) for host, bucket in self.buckets.items()}
@@ -0,0 +1,61 @@
+"""Markdown渲染器：trans.py 根据 MARKDOWN_RENDERER 选择把日记转换为HTML所用的库
+
+python-markdown 为默认依赖；markdown-it-py 和 mistune 为可选，速度更快：
+pip install markdown-it-py mistune
+"""
+import functools
+
+import markdown
+
+try:
+    from markdown_it import MarkdownIt
+except ImportError:  # 可选渲染器，未安装时不能选择
+    MarkdownIt = None
+
+try:
+    import mistune
+except ImportError:  # 可选渲染器，未安装时不能选择
+    mistune = None
+
+
+def _python_markdown():
+    md = markdown.Markdown(extensions=["fenced_code", "tables", "nl2br"])
+
+    def render(text):
+        md.reset()
+        return md.convert(text)
+    return render
+
+
+def _markdown_it():
+    # 与 python-markdown 的设置保持一致：保留HTML、单个换行转为<br>、支持表格
+    md = MarkdownIt("commonmark", {"html": True, "breaks": True}).enable("table")
+    return md.render
+
+
+def _mistune():
+    return mistune.create_markdown(escape=False, hard_wrap=True, plugins=["table"])
+
+
+# 渲染器名称 -> (是否已安装, 创建渲染函数)
+RENDERERS = {
+    "python-markdown": (lambda: True, _python_markdown),
+    "markdown-it": (lambda: MarkdownIt is not None, _markdown_it),
+    "mistune": (lambda: mistune is not None, _mistune),
+}
+
+
+def available_renderers():
+    """当前环境中可以使用的渲染器名称"""
+    return [name for name, (installed, _) in RENDERERS.items() if installed()]
+
+
+@functools.lru_cache(maxsize=None)
+def get_renderer(name):
+    """返回渲染函数 render(markdown_text) -> html（每个进程中只创建一次）"""
+    if name not in RENDERERS:
+        raise ValueError(f"未知的Markdown渲染器: {name}，可选: {', '.join(RENDERERS)}")
+    installed, factory = RENDERERS[name]
+    if not installed():
+        raise RuntimeError(f"Markdown渲染器 {name} 未安装")
+    return factory()
@@ -0,0 +1,162 @@
+import asyncio
+import datetime
+import json
+import os
+import random
+import time
+
+import requests
+
+JOURNAL_FILE = "failed_journal.json"  # 失败记录文件名（保存在myself/partner目录下）
+JOURNAL_MAX_ATTEMPTS = 5  # 连续失败这么多次运行后不再记录，避免每次运行都重试
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """判断错误是否值得重试：超时、连接错误、429和5xx可以重试，其他4xx和接口错误不重试"""
+    status = getattr(error, "status", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+
+    if isinstance(error, (requests.exceptions.Timeout,
+                          requests.exceptions.ConnectionError,
+                          requests.exceptions.ChunkedEncodingError,
+                          asyncio.TimeoutError,
+                          ConnectionError)):
+        return True
+    # aiohttp 的连接/传输错误（未安装aiohttp时不会出现）
+    if type(error).__module__.startswith("aiohttp"):
+        return True
+    # 图片长度不完整等传输问题
+    if isinstance(error, IOError) and not isinstance(error, (FileNotFoundError, PermissionError)):
+        return True
+    return False
+
+
+class RetryPolicy:
+    """带随机抖动的指数退避重试"""
+
+    def __init__(self, attempts=4, base_delay=1.0, max_delay=30.0, on_retry=None):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_retry = on_retry  # 每次重试前调用 on_retry(error)，用于统计重试次数
+
+    def delay(self, attempt):
+        """第 attempt 次失败后的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, func, *args, **kwargs):
+        for attempt in range(self.attempts):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt + 1 >= self.attempts or not is_retryable(e):
+                    raise
+                if self.on_retry:
+                    self.on_retry(e)
+                time.sleep(self.delay(attempt))
+
+    async def call_async(self, func, *args, **kwargs):
+        for attempt in range(self.attempts):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt + 1 >= self.attempts or not is_retryable(e):
+                    raise
+                if self.on_retry:
+                    self.on_retry(e)
+                await asyncio.sleep(self.delay(attempt))
+
+
+class FailureJournal:
+    """运行结束时仍然失败的日记和图片，下次运行时优先处理"""
+
+    def __init__(self, base_folder, max_attempts=JOURNAL_MAX_ATTEMPTS):
+        self.path = os.path.join(base_folder, JOURNAL_FILE)
+        self.max_attempts = max_attempts
+        self.diaries = []
+        self.images = []
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.diaries = data.get("diaries", [])
+                self.images = data.get("images", [])
+            except Exception:
+                self.diaries = []
+                self.images = []
+
+    def has_pending(self):
+        return bool(self.diaries or self.images)
+
+    def pending_diary_ids(self, user_id):
+        return [entry["id"] for entry in self.diaries
+                if str(entry.get("user_id")) == str(user_id)]
+
+    def pending_images(self, user_id):
+        """返回上次失败的图片下载任务"""
+        return [{
+            "image_id": entry["image_id"],
+            "user_id": entry["user_id"],
+            "folder": entry["folder"],
+            "month": entry.get("month", "")
+        } for entry in self.images if str(entry.get("user_id")) == str(user_id)]
+
+    def save(self, user_id, failed_diaries, failed_images):
+        """用本次结果替换该用户的失败记录（其他用户的记录保留），没有失败时删除文件
+
+        failed_diaries: [{"id", "error"}]
+        failed_images: [下载任务字典 + "error"]，error 为异常时不可重试的错误（如图片404）不记录；
+        已连续失败 max_attempts 次的也不再记录。返回 (记录的日记数, 记录的图片数)
+        """
+        now = datetime.datetime.now().isoformat()
+        previous = {("diary", str(e["id"])): e for e in self.diaries}
+        previous.update({("image", str(e["image_id"])): e for e in self.images})
+
+        def attempts(kind, key):
+            return previous.get((kind, str(key)), {}).get("attempts", 0) + 1
+
+        def worth_retrying(kind, key, error):
+            if isinstance(error, BaseException) and not is_retryable(error):
+                return False
+            return attempts(kind, key) <= self.max_attempts
+
+        failed_diaries = [entry for entry in failed_diaries
+                          if worth_retrying("diary", entry["id"], entry.get("error"))]
+        failed_images = [task for task in failed_images
+                         if worth_retrying("image", task["image_id"], task.get("error"))]
+
+        self.diaries = [e for e in self.diaries if str(e.get("user_id")) != str(user_id)] + [{
+            "id": entry["id"],
+            "user_id": user_id,
+            "error": str(entry.get("error", "")),
+            "attempts": attempts("diary", entry["id"]),
+            "time": now
+        } for entry in failed_diaries]
+        self.images = [e for e in self.images if str(e.get("user_id")) != str(user_id)] + [{
+            "image_id": task["image_id"],
+            "user_id": user_id,
+            "folder": task["folder"],
+            "month": task.get("month", ""),
+            "error": str(task.get("error", "")),
+            "attempts": attempts("image", task["image_id"]),
+            "time": now
+        } for task in failed_images]
+
+        if not self.has_pending():
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return len(failed_diaries), len(failed_images)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"diaries": self.diaries, "images": self.images},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        return len(failed_diaries), len(failed_images)
@@ -0,0 +1,124 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 缩略图为可选功能，未安装Pillow时页面直接使用原图
+    Image = None
+
+THUMBS_FOLDER = "thumbs"  # 缩略图保存在 html/Pictures/thumbs 下
+THUMB_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+IMG_TAG_RE = re.compile(r'<img([^>]*?)\ssrc="\./Pictures/([^"/]+)"([^>]*?)\s*/?>')
+
+
+def make_thumbnail(src, dst, max_width):
+    """生成一张缩略图（在子进程中运行），返回 {"width", "height", "thumb"}
+
+    原图不比 max_width 宽时不生成缩略图，thumb 为 False，尺寸为原图尺寸
+    """
+    with Image.open(src) as img:
+        # 手机照片的方向记录在EXIF中，先按EXIF旋转
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        if width <= max_width:
+            return {"width": width, "height": height, "thumb": False}
+
+        height = max(1, round(height * max_width / width))
+        img = img.resize((max_width, height), Image.LANCZOS)
+        image_format = {".png": "PNG", ".webp": "WEBP"}.get(os.path.splitext(dst)[1].lower(), "JPEG")
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        tmp_path = dst + ".tmp"
+        img.save(tmp_path, image_format, quality=80, optimize=True)
+        os.replace(tmp_path, dst)
+        return {"width": max_width, "height": height, "thumb": True}
+
+
+def generate_thumbnails(pictures_folder, names, cache, max_width, workers=None, unchanged=()):
+    """为 html/Pictures 中的图片生成缩略图
+
+    cache: 上次的结果 {图片名: {"mtime_ns", "size", "width", "height", "thumb"}}，
+    原图和宽度设置都未变化、缩略图仍然存在时不重新处理；
+    处理失败的图片记录为 {"mtime_ns", "size", "thumb": False, "error"}，原图不变时不再重试；
+    unchanged 中的图片已确认没有变化，有缓存记录时直接沿用，不再检查文件
+    返回 (本次的结果, 新处理的图片数, 本次处理失败的 [(图片名, 错误信息)])
+    """
+    if Image is None:
+        return {}, 0, []
+
+    thumbs_folder = os.path.join(pictures_folder, THUMBS_FOLDER)
+    if not os.path.isdir(thumbs_folder):
+        cache = {}
+    os.makedirs(thumbs_folder, exist_ok=True)
+
+    result = {}
+    todo = []
+    for name in sorted(set(names)):
+        if os.path.splitext(name)[1].lower() not in THUMB_EXTS:
+            continue
+        entry = cache.get(name)
+        if name in unchanged and entry and entry.get("max_width") == max_width:
+            result[name] = entry
+            continue
+        src = os.path.join(pictures_folder, name)
+        try:
+            stat = os.stat(src)
+        except OSError:
+            continue
+        dst = os.path.join(thumbs_folder, name)
+        if (entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+                and entry.get("max_width") == max_width
+                and (not entry["thumb"] or os.path.exists(dst))):
+            result[name] = entry
+            continue
+        todo.append((name, src, dst, stat))
+
+    failures = []
+
+    def record(name, stat, info):
+        result[name] = dict(info, mtime_ns=stat.st_mtime_ns, size=stat.st_size, max_width=max_width)
+
+    def record_failure(name, stat, error):
+        failures.append((name, str(error)))
+        record(name, stat, {"thumb": False, "error": str(error)})
+
+    if len(todo) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(name, stat, executor.submit(make_thumbnail, src, dst, max_width))
+                       for name, src, dst, stat in todo]
+            for name, stat, future in futures:
+                try:
+                    record(name, stat, future.result())
+                except Exception as e:
+                    record_failure(name, stat, e)
+    else:
+        for name, src, dst, stat in todo:
+            try:
+                record(name, stat, make_thumbnail(src, dst, max_width))
+            except Exception as e:
+                record_failure(name, stat, e)
+
+    # 删除已不再使用的缩略图
+    for name in cache:
+        if name not in result and cache[name].get("thumb"):
+            path = os.path.join(thumbs_folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    return result, len(todo), failures
+
+
+def apply_thumbnails(fragment, thumbs):
+    """把日记片段中的图片改为懒加载的缩略图，并链接到原图"""
+    def replace(match):
+        before, name, after = match.groups()
+        info = thumbs.get(name)
+        src = f"./Pictures/{THUMBS_FOLDER}/{name}" if info and info["thumb"] else f"./Pictures/{name}"
+        # 处理失败的图片没有尺寸
+        size = f' width="{info["width"]}" height="{info["height"]}"' if info and "width" in info else ""
+        return (f'<a href="./Pictures/{name}" target="_blank">'
+                f'<img{before} src="{src}"{after} loading="lazy"{size} /></a>')
+
+    return IMG_TAG_RE.sub(replace, fragment)
@@ -0,0 +1,76 @@
+"""登录token缓存（main.py 和 plan.py 共用）
+
+登录成功后把token和用户ID保存到本地文件，有效期内的运行直接使用，不再提交邮箱和密码；
+服务器拒绝缓存的token时由 DiaryDownloader 重新登录并更新缓存
+"""
+import json
+import os
+import time
+
+TOKEN_CACHE_FILE = ".token_cache.json"  # token缓存文件名（保存在运行目录下）
+AUTH_REJECTED_STATUS = {401, 403}  # 接口以这些状态码拒绝token时重新登录
+
+
+class TokenCache:
+    """按 接口地址+邮箱 保存 {"token", "user_id", "saved_at"}
+
+    文件权限为0600（只有当前用户可以读写，Windows下只能设置只读位，依赖用户目录的权限），
+    ttl 秒后过期，ttl 为 0 表示不使用缓存
+    """
+
+    def __init__(self, path=TOKEN_CACHE_FILE, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(api_base, email):
+        return f"{api_base}|{email.strip().lower()}"
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _write(self, entries):
+        if not entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = self.path + ".tmp"
+        # 创建时就限制权限，避免token短暂地对其他用户可读
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def load(self, api_base, email):
+        """返回未过期的 (token, user_id)，没有时返回 None"""
+        if self.ttl <= 0 or not email:
+            return None
+        entry = self._read().get(self._key(api_base, email))
+        if not entry or not entry.get("token"):
+            return None
+        if time.time() - entry.get("saved_at", 0) > self.ttl:
+            return None
+        return entry["token"], entry.get("user_id")
+
+    def save(self, api_base, email, token, user_id):
+        if self.ttl <= 0 or not email:
+            return
+        entries = self._read()
+        now = time.time()
+        # 顺便清理已过期的记录
+        entries = {key: entry for key, entry in entries.items()
+                   if now - entry.get("saved_at", 0) <= self.ttl}
+        entries[self._key(api_base, email)] = {"token": token, "user_id": user_id, "saved_at": now}
+        self._write(entries)
+
+    def clear(self, api_base, email):
+        """删除被服务器拒绝的token"""
+        entries = self._read()
+        if entries.pop(self._key(api_base, email), None) is not None:
+            self._write(entries)
@@ -1,80 +1,107 @@
-import markdown
+"""根据Markdown日记生成HTML页面
+
+可以作为脚本运行: python trans.py myself
+也可以在其他模块中调用 build_html("myself")，直接得到生成结果
+"""
 import datetime
+import hashlib
+import json
 import os
+import functools
 import glob
+import html
 import re
 import shutil
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-# 接受 base_folder 参数
-if len(sys.argv) > 1:
-    base_folder = sys.argv[1]
-else:
-    base_folder = "myself"
+from image_cache import link_image, LINK_MODES
+from renderers import get_renderer
+from thumbnails import generate_thumbnails, apply_thumbnails
 
 REVERSE_ORDER = True  # True表示按时间倒序排序
 
+# 分页方式: "single" 全部日记生成一个 diaries.html；
+# "month"/"year" 每月/每年生成一个页面，并生成目录页 index.html（书签保存目录页即可）
+PAGE_MODE = "single"
+
+# 懒加载时间线: 日记内容按块写入 chunks/ 目录，页面只渲染可视区域附近的日记，
+# 适合日记很多的导出；False 时所有日记直接写在页面中
+LAZY_TIMELINE = False
+TIMELINE_CHUNK_SIZE = 50  # 每块的日记篇数
+
+# 缩略图（需要安装Pillow）: 宽于 THUMBNAIL_WIDTH 的图片生成缩略图，页面中点击缩略图查看原图；0 表示不生成
+THUMBNAIL_WIDTH = 800
+THUMBNAIL_WORKERS = None  # 生成缩略图的进程数，None 表示CPU核数
+
+# Markdown渲染器: "python-markdown"（默认）、"markdown-it"（需安装markdown-it-py）或 "mistune"，
+# 后两者速度更快，运行 python benchmark.py --renderers 可检查输出是否一致并比较速度
+MARKDOWN_RENDERER = "python-markdown"
+
+# Markdown转HTML使用的进程数: None 表示CPU核数，1 表示在当前进程中渲染；
+# 需要渲染的日记少于 RENDER_PARALLEL_MIN 篇时不启动进程池
+RENDER_WORKERS = None
+RENDER_CHUNK_SIZE = 32  # 每个进程一次渲染的篇数
+RENDER_PARALLEL_MIN = 64
+
+# 图片放入 html/Pictures 的方式: "hardlink" 硬链接、"reflink" 写时复制（btrfs/xfs/APFS等）、
+# "symlink" 符号链接、"copy" 复制；前三种不占用额外磁盘空间，不支持时自动退回复制
+LINK_MODE = "hardlink"
+
+# 渲染结果缓存（保存在输出目录中），Markdown文件未变化时直接复用上次生成的HTML片段
+BUILD_CACHE_FILE = ".build_cache.json"
+BUILD_CACHE_VERSION = 4  # 修改片段生成方式时加一，使旧缓存失效
+
 # 获取脚本所在目录（项目根目录）
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 # 从项目根目录的 html 文件夹读取模板文件（不是 base_folder/html）
 TEMPLATE_FILE = os.path.join(script_dir, "html", "template.html")
-if not os.path.exists(TEMPLATE_FILE):
-    raise FileNotFoundError(f"模板文件不存在: {TEMPLATE_FILE}")
 
-with open(TEMPLATE_FILE, "r", encoding="utf-8") as f:
-    TEMPLATE = f.read()
+# 搜索索引（JS文件，页面通过<script>加载，直接打开本地文件时也能使用）
+SEARCH_INDEX_FILE = "search_index.js"
 
 WEEKDAY_MAP = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
 
-# 输入输出路径（base_folder 是 myself 或 partner）
-input_folder = os.path.join(script_dir, base_folder, "markdown")
-output_dir = os.path.join(script_dir, base_folder, "html")  # 输出到 myself/html
-pictures_folder = os.path.join(output_dir, "Pictures")
-
-# 创建输出目录
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(pictures_folder, exist_ok=True)
 
-diaries_html = []
+def load_build_cache(path, renderer=MARKDOWN_RENDERER):
+    """读取渲染缓存，版本不一致或文件损坏时返回空缓存；换了渲染器时只丢弃已渲染的片段"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == BUILD_CACHE_VERSION:
+            if cache.get("renderer") != renderer:
+                cache["files"] = {}
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"version": BUILD_CACHE_VERSION, "renderer": renderer, "files": {}}
 
-# 获取所有 markdown 文件
-filepaths = sorted(glob.glob(os.path.join(
-    input_folder, "**/*.md"), recursive=True))
 
-if REVERSE_ORDER:
-    filepaths = list(reversed(filepaths))
+def render_diary(filepath, diary_md, renderer=MARKDOWN_RENDERER):
+    """把一篇日记的 Markdown 渲染为 <article> 片段
 
-# 处理每个日记文件
-for filepath in filepaths:
+    返回 {"fragment": 片段, "images": 引用的图片列表, "date": 日期, "text": 纯文本, "words": 字数}
+    """
     filename = os.path.basename(filepath)
     name, _ = os.path.splitext(filename)
 
-    with open(filepath, "r", encoding="utf-8") as f:
-        diary_md = f.read()
-
     # 移除第一行（日期标题）
     diary_md = re.sub(r'^\s*.*\n', '', diary_md, count=1)
 
     # 处理图片引用
+    images = []
     for md_img_match in re.findall(r'!\[.*?\]\((.*?)\)', diary_md):
         img_name = os.path.basename(md_img_match)
-        original_img_path = os.path.join(
-            os.path.dirname(filepath), md_img_match)
-
-        # 复制图片到输出目录
-        if os.path.exists(original_img_path):
-            target_img_path = os.path.join(pictures_folder, img_name)
-            # 避免重复复制
-            if not os.path.exists(target_img_path):
-                shutil.copy2(original_img_path, target_img_path)
+        # 缓存中保存相对于日记文件的路径
+        images.append([md_img_match, img_name])
 
         # 更新 markdown 中的图片路径
         diary_md = diary_md.replace(md_img_match, f"./Pictures/{img_name}")
 
     # 将 Markdown 转换为 HTML
-    diary_html = markdown.markdown(
-        diary_md, extensions=["fenced_code", "tables", "nl2br"])
+    diary_html = get_renderer(renderer)(diary_md)
 
     # 解析日期
     try:
@@ -86,7 +113,7 @@ for filepath in filepaths:
 
     # 生成日记 HTML 片段
     article = f"""
-<article class="diary">
+<article class="diary" id="d-{date}">
   <header class="meta">
     <div class="date">{date}</div>
     <div class="weekday">{weekday}</div>
@@ -95,18 +122,363 @@ for filepath in filepaths:
   <section class="content">{diary_html}</section>
 </article>
 """
-    diaries_html.append(article)
+    # 去掉标签后的纯文本，用于搜索索引
+    text = re.sub(r"\s+", " ", html.unescape(re.sub(r"<[^>]+>", " ", diary_html))).strip()
+
+    return {"fragment": article, "images": images, "date": date.isoformat(),
+            "text": text, "words": count_words(text)}
+
+
+def count_words(text):
+    """字数统计：只计算中文、英文字母和数字"""
+    return len(re.findall(r"[\u4e00-\u9fa5a-zA-Z0-9]", text))
+
+
+def render_batch(items, renderer=MARKDOWN_RENDERER):
+    """渲染一批日记（可在子进程中运行），items: [(文件路径, Markdown内容)]"""
+    return [render_diary(filepath, diary_md, renderer) for filepath, diary_md in items]
+
+
+def render_all(items, workers=RENDER_WORKERS, chunk_size=RENDER_CHUNK_SIZE, renderer=MARKDOWN_RENDERER):
+    """渲染多篇日记，结果顺序与 items 一致"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(items) < RENDER_PARALLEL_MIN:
+        return render_batch(items, renderer)
+
+    batches = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map 按提交顺序返回结果，输出顺序与串行渲染相同
+        return [entry for batch in executor.map(functools.partial(render_batch, renderer=renderer), batches) for entry in batch]
+
+
+def build_search_index(entries):
+    """生成搜索索引
+
+    entries: [(日记日期, 所在页面, 纯文本)]，按显示顺序排列
+    页面名只保存一次，diaries 中为 [日期, 页面编号, 纯文本]；页面搜索时直接在纯文本中查找关键字
+    （几千篇日记也只需几毫秒），索引大小与纯文本相当，不再为每个二元组保存日记编号列表
+    """
+    pages = []
+    page_ids = {}
+    diaries = []
+    for date, page, text in entries:
+        if page not in page_ids:
+            page_ids[page] = len(pages)
+            pages.append(page)
+        diaries.append([date, page_ids[page], text])
+    return {"pages": pages, "diaries": diaries}
+
+
+def page_name(date, page_mode):
+    """日记所属页面的文件名，例如 diaries-2024-05.html"""
+    if page_mode == "month":
+        return f"diaries-{date[:7]}.html"
+    if page_mode == "year":
+        return f"diaries-{date[:4]}.html"
+    return "diaries.html"
+
+
+def render_page_nav(pages, index):
+    """分页模式下页面顶部的导航：上一页、目录、下一页"""
+    links = []
+    if index > 0:
+        links.append(f'<a class="btn" href="{pages[index - 1][0]}">← {pages[index - 1][1]}</a>')
+    links.append('<a class="btn" href="index.html">目录</a>')
+    if index + 1 < len(pages):
+        links.append(f'<a class="btn" href="{pages[index + 1][0]}">{pages[index + 1][1]} →</a>')
+    return f'<nav class="page-nav">{"".join(links)}</nav>'
+
+
+def render_index(pages):
+    """目录页内容：按年份列出各页面及日记篇数"""
+    years = {}
+    for filename, label, count in pages:
+        years.setdefault(label[:4], []).append((filename, label, count))
+
+    articles = []
+    for year, items in years.items():
+        total = sum(count for _, _, count in items)
+        links = "".join(
+            f'<li><a href="{filename}">{label}</a>（{count}篇）</li>' for filename, label, count in items)
+        articles.append(f"""
+<article class="diary">
+  <header class="meta">
+    <div class="date">{year}年</div>
+    <div class="weekday">{total}篇</div>
+  </header>
+  <h1 class="title"></h1>
+  <section class="content"><ul class="page-list">{links}</ul></section>
+</article>
+""")
+    return "\n".join(articles)
+
+
+def render_lazy_timeline(page, fragments, chunk_size):
+    """懒加载模式：把日记片段分块，返回 (页面中的时间线信息脚本, {块文件名: 内容})"""
+    stem = page[:-len(".html")]
+    chunks = []
+    files = {}
+    for start in range(0, len(fragments), chunk_size):
+        name = f"{stem}-{start // chunk_size:04d}"
+        part = fragments[start:start + chunk_size]
+        chunks.append({"name": name, "count": len(part),
+                       "first": part[0][0], "last": part[-1][0]})
+        data = json.dumps([fragment for _, fragment in part], ensure_ascii=False, separators=(",", ":"))
+        files[f"chunks/{name}.js"] = f"DIARY_CHUNK({json.dumps(name)},{data});\n"
+
+    info = json.dumps({"chunks": chunks}, ensure_ascii=False, separators=(",", ":"))
+    return f"<script>window.DIARY_TIMELINE={info};</script>", files
+
+
+def write_if_changed(path, content, old_hash):
+    """内容哈希与上次相同且文件存在时不重写，返回 (哈希, 是否写入)"""
+    new_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    if new_hash == old_hash and os.path.exists(path):
+        return new_hash, False
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return new_hash, True
+
+
+def build_html(base_folder, root_dir=None, template_path=None,
+               reverse_order=REVERSE_ORDER, sources=None, page_mode=PAGE_MODE,
+               lazy=LAZY_TIMELINE, chunk_size=TIMELINE_CHUNK_SIZE,
+               thumbnail_width=THUMBNAIL_WIDTH, thumbnail_workers=THUMBNAIL_WORKERS,
+               link_mode=LINK_MODE, render_workers=RENDER_WORKERS,
+               renderer=MARKDOWN_RENDERER):
+    """生成 base_folder/html/diaries.html（分页模式下生成各期页面和 index.html）
+
+    root_dir: base_folder 所在目录，默认为项目根目录
+    template_path: 模板文件，默认为项目根目录的 html/template.html
+    sources: 可选的 {Markdown文件路径: 内容}，刚写入的日记直接使用内存中的内容，不再从磁盘读取
+    page_mode: "single"、"month" 或 "year"
+    lazy: 是否使用懒加载时间线，chunk_size 为每块的日记篇数
+    thumbnail_width: 缩略图宽度，0 表示不生成缩略图
+    link_mode: 图片放入 html/Pictures 的方式，见 LINK_MODE
+    render_workers: Markdown转HTML使用的进程数，见 RENDER_WORKERS
+    renderer: Markdown渲染器，见 MARKDOWN_RENDERER
+
+    返回生成结果字典，模板不存在等错误直接抛出异常
+    """
+    start_time = time.perf_counter()
+    root_dir = root_dir or script_dir
+    template_path = template_path or TEMPLATE_FILE
+    if page_mode not in ("single", "month", "year"):
+        raise ValueError(f"未知的分页方式: {page_mode}")
+    # 提前检查渲染器是否可用
+    get_renderer(renderer)
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"未知的图片链接方式: {link_mode}")
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"模板文件不存在: {template_path}")
+
+    with open(template_path, "r", encoding="utf-8") as f:
+        template = f.read()
+
+    sources = {os.path.abspath(path): content
+               for path, content in (sources or {}).items()}
+
+    # 输入输出路径（base_folder 是 myself 或 partner）
+    input_folder = os.path.join(root_dir, base_folder, "markdown")
+    output_dir = os.path.join(root_dir, base_folder, "html")  # 输出到 myself/html
+    pictures_folder = os.path.join(output_dir, "Pictures")
+
+    # 创建输出目录
+    pictures_existed = os.path.isdir(pictures_folder)
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(pictures_folder, exist_ok=True)
+
+    cache_path = os.path.join(output_dir, BUILD_CACHE_FILE)
+    build_cache = load_build_cache(cache_path, renderer)
+    cached_files = build_cache["files"]
+    new_cache_files = {}
+    # 已放入 html/Pictures 的图片清单 {图片名: {"src": 原图相对路径, "mode": 方式}}，
+    # 清单中已有的图片不再逐个检查
+    placed_images = build_cache.get("images", {}) if pictures_existed else {}
+    new_placed_images = {}
+    link_counts = {}
+
+    # 页面文件名 -> [(日期, 日记片段)]（按显示顺序）
+    page_fragments = {}
+    total_words = 0
+    # 搜索索引条目 (日期, 页面, 纯文本)
+    search_entries = []
+
+    # 获取所有 markdown 文件
+    filepaths = sorted(glob.glob(os.path.join(
+        input_folder, "**/*.md"), recursive=True))
+
+    if reverse_order:
+        filepaths = list(reversed(filepaths))
+
+    # 找出需要重新渲染的日记，其余直接使用缓存
+    entries = {}
+    to_render = []  # (key, 文件路径, Markdown内容, 哈希, stat)
+    for filepath in filepaths:
+        key = os.path.relpath(filepath, input_folder).replace(os.sep, "/")
+        stat = os.stat(filepath)
+        entry = cached_files.get(key)
+        source = sources.get(os.path.abspath(filepath))
+
+        # 修改时间和大小都未变化时直接使用缓存，否则比较内容哈希
+        if source is not None or not (entry and entry["mtime_ns"] == stat.st_mtime_ns
+                                      and entry["size"] == stat.st_size):
+            if source is not None:
+                raw = source.encode("utf-8")
+            else:
+                with open(filepath, "rb") as f:
+                    raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if not (entry and entry["sha256"] == digest):
+                to_render.append((key, filepath, raw.decode("utf-8"), digest, stat))
+                continue
+            entry = dict(entry, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+
+        entries[key] = entry
+
+    # 渲染有变化的日记（篇数较多时使用多进程）
+    render_start = time.perf_counter()
+    rendered = render_all([(filepath, diary_md) for _, filepath, diary_md, _, _ in to_render],
+                          render_workers, renderer=renderer)
+    for (key, _, _, digest, stat), entry in zip(to_render, rendered):
+        entries[key] = dict(entry, sha256=digest, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    render_time = time.perf_counter() - render_start
+
+    # 按显示顺序处理每篇日记
+    for filepath in filepaths:
+        key = os.path.relpath(filepath, input_folder).replace(os.sep, "/")
+        entry = new_cache_files[key] = entries[key]
+
+        # 把图片放到输出目录（图片可能晚于日记下载，清单中没有的图片每次都要检查）
+        for md_img_path, img_name in entry["images"]:
+            original_img_path = os.path.join(os.path.dirname(filepath), md_img_path)
+            src_key = os.path.relpath(original_img_path, input_folder).replace(os.sep, "/")
+            placed = placed_images.get(img_name)
+            if placed and placed["src"] == src_key:
+                new_placed_images[img_name] = placed
+                continue
+            if os.path.exists(original_img_path):
+                target_img_path = os.path.join(pictures_folder, img_name)
+                if os.path.lexists(target_img_path):
+                    # 旧版本复制过的图片
+                    mode = "existing"
+                else:
+                    mode = link_image(original_img_path, target_img_path, link_mode)
+                    link_counts[mode] = link_counts.get(mode, 0) + 1
+                new_placed_images[img_name] = {"src": src_key, "mode": mode}
+
+        page = page_name(entry["date"], page_mode)
+        page_fragments.setdefault(page, []).append((entry["date"], entry["fragment"]))
+        total_words += entry["words"]
+        search_entries.append((entry["date"], page, entry["text"]))
+
+    # 生成缩略图（未变化的图片不重新处理），并把片段中的图片改为懒加载的缩略图
+    thumbs, thumbnail_count, thumbnail_failures = {}, 0, []
+    if thumbnail_width:
+        # 清单中原有的图片没有变化，缩略图直接沿用上次的结果
+        unchanged = {name for name, placed in new_placed_images.items()
+                     if placed_images.get(name) == placed}
+        thumbs, thumbnail_count, thumbnail_failures = generate_thumbnails(
+            pictures_folder, new_placed_images, build_cache.get("thumbs", {}),
+            thumbnail_width, thumbnail_workers, unchanged)
+    page_fragments = {page: [(date, apply_thumbnails(fragment, thumbs)) for date, fragment in fragments]
+                      for page, fragments in page_fragments.items()}
+
+    # 生成最终的 HTML 文件（内容未变化时不重写，保持书签页面的修改时间不变）
+    old_outputs = build_cache.get("outputs", {})
+    outputs = {}
+    written_files = []
+
+    def write_output(filename, content):
+        path = os.path.join(output_dir, filename)
+        outputs[filename], written = write_if_changed(path, content, old_outputs.get(filename))
+        if written:
+            written_files.append(path)
+
+    def write_page(filename, content_html, nav_html=""):
+        write_output(filename, template.replace("{{PAGE_NAV}}", nav_html)
+                     .replace("{{WORD_COUNT}}", str(total_words))
+                     .replace("{{CONTENT_HTML}}", content_html))
+
+    def write_diary_page(filename, fragments, nav_html=""):
+        if lazy and fragments:
+            content_html, chunk_files = render_lazy_timeline(filename, fragments, chunk_size)
+            os.makedirs(os.path.join(output_dir, "chunks"), exist_ok=True)
+            for chunk_file, content in chunk_files.items():
+                write_output(chunk_file, content)
+        else:
+            content_html = "\n".join(fragment for _, fragment in fragments)
+        write_page(filename, content_html, nav_html)
+
+    search_index = json.dumps(build_search_index(search_entries),
+                              ensure_ascii=False, separators=(",", ":"))
+    write_output(SEARCH_INDEX_FILE, f"window.DIARY_SEARCH_INDEX={search_index};\n")
+
+    if page_mode == "single":
+        write_diary_page("diaries.html", page_fragments.get("diaries.html", []))
+        output_file = os.path.join(output_dir, "diaries.html")
+    else:
+        # (文件名, 显示名称, 篇数)，顺序与日记顺序一致
+        pages = [(filename, filename[len("diaries-"):-len(".html")], len(fragments))
+                 for filename, fragments in page_fragments.items()]
+        for i, (filename, _, _) in enumerate(pages):
+            write_diary_page(filename, page_fragments[filename], render_page_nav(pages, i))
+        write_page("index.html", render_index(pages))
+        output_file = os.path.join(output_dir, "index.html")
+
+    # 删除上次生成、本次已不存在的页面（例如切换了分页方式）
+    for filename in old_outputs:
+        if filename not in outputs and os.path.exists(os.path.join(output_dir, filename)):
+            os.remove(os.path.join(output_dir, filename))
+
+    build_cache = {"version": BUILD_CACHE_VERSION, "renderer": renderer,
+                   "outputs": outputs, "images": new_placed_images,
+                   "thumbs": thumbs, "files": new_cache_files}
+    tmp_cache_path = cache_path + ".tmp"
+    with open(tmp_cache_path, "w", encoding="utf-8") as f:
+        json.dump(build_cache, f, ensure_ascii=False)
+    os.replace(tmp_cache_path, cache_path)
+
+    # 复制 logo 和背景图到输出目录（从项目根目录/html/ 复制到 myself/html/）
+    for fname in ["logo.png", "background.png"]:
+        src = os.path.join(script_dir, "html", fname)
+        dst = os.path.join(output_dir, fname)
+        if os.path.exists(src):
+            shutil.copy2(src, dst)
+
+    return {
+        "output_dir": output_dir,
+        "output_file": output_file,
+        "output_files": [os.path.join(output_dir, filename) for filename in outputs],
+        "written_files": written_files,
+        "changed": bool(written_files),
+        "total": len(filepaths),
+        "rendered": len(to_render),
+        "render_time": render_time,
+        "copied_images": sum(link_counts.values()),
+        "link_counts": link_counts,
+        "thumbnails": thumbnail_count,
+        "thumbnail_failures": thumbnail_failures,
+        "words": total_words,
+        "elapsed": time.perf_counter() - start_time
+    }
+
+
+def main():
+    # 接受 base_folder 参数和可选的分页方式: python trans.py myself month
+    base_folder = sys.argv[1] if len(sys.argv) > 1 else "myself"
+    page_mode = sys.argv[2] if len(sys.argv) > 2 else PAGE_MODE
+    result = build_html(base_folder, page_mode=page_mode)
 
-# 生成最终的 HTML 文件
-output_file = os.path.join(output_dir, "diaries.html")
-with open(output_file, "w", encoding="utf-8") as f:
-    f.write(TEMPLATE.replace("{{CONTENT_HTML}}", "\n".join(diaries_html)))
+    print(f"[INFO] 重新渲染 {result['rendered']}/{result['total']} 篇日记")
+    for name, error in result["thumbnail_failures"]:
+        print(f"[WARN] 缩略图生成失败 {name}: {error}")
+    if result["changed"]:
+        for path in result["written_files"]:
+            print(f"[INFO] 已生成 {path}")
+    else:
+        print(f"[INFO] 内容未变化，跳过写入 {result['output_file']}")
 
-# 复制 logo 和背景图到输出目录（从项目根目录/html/ 复制到 myself/html/）
-for fname in ["logo.png", "background.png"]:
-    src = os.path.join(script_dir, "html", fname)
-    dst = os.path.join(output_dir, fname)
-    if os.path.exists(src):
-        shutil.copy2(src, dst)
 
-print(f"[INFO] 已生成 {output_file}")
+if __name__ == "__main__":
+    main()